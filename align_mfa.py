@@ -1,6 +1,7 @@
 # align_mfa.py
 from __future__ import annotations
 
+import os
 import shutil
 import subprocess
 from pathlib import Path
@@ -8,15 +9,19 @@ from typing import Dict, Any
 
 import re
 
+_RE_NONWORD = re.compile(r"[^a-z0-9\s']")  # keep words + apostrophes
+_RE_WS = re.compile(r"\s+")
+
 def normalize_transcript(text: str) -> str:
     text = text.lower()
-    text = re.sub(r"[^a-z0-9\s']", " ", text)  # keep words + apostrophes
-    text = re.sub(r"\s+", " ", text).strip()
+    text = _RE_NONWORD.sub(" ", text)
+    text = _RE_WS.sub(" ", text).strip()
     return text
 
 def build_transcript_from_yaml(spec: Dict[str, Any]) -> str:
     # any abbreviations or special words will break, need to add fix #TODO
-    return " ".join(scene["text"].strip() for scene in spec["scenes"] if scene.get("text"))
+    texts = (scene["text"].strip() for scene in spec["scenes"] if scene.get("text"))
+    return " ".join(t for t in texts if t)
 
 
 def prepare_mfa_input(audio_wav: str | Path, transcript_text: str, out_dir: str | Path) -> Path:
@@ -26,7 +31,16 @@ def prepare_mfa_input(audio_wav: str | Path, transcript_text: str, out_dir: str
     wav_path = out_dir / "audio.wav"
     txt_path = out_dir / "audio.txt"
 
-    shutil.copy(audio_wav, wav_path)
+    # MFA only reads the wav, so link it instead of copying the bytes
+    if wav_path.exists() or wav_path.is_symlink():
+        wav_path.unlink()
+    try:
+        os.link(audio_wav, wav_path)
+    except (OSError, NotImplementedError):
+        try:
+            os.symlink(Path(audio_wav).resolve(), wav_path)
+        except OSError:
+            shutil.copy(audio_wav, wav_path)
     txt_path.write_text(transcript_text, encoding="utf-8")
 
     return out_dir
@@ -48,7 +62,7 @@ def run_mfa_align(
 
     if use_json:
         cmd += ["--output_format", "json"]
-    cmd += [" --single_speaker"]
+    cmd += ["--single_speaker", "--clean", "-j", str(os.cpu_count() or 1)]
     subprocess.run(cmd, check=True)
 
     # Expected output
@@ -2,32 +2,74 @@ from __future__ import annotations
 from typing import Optional
 from typing import Union
 from pathlib import Path
-from typing import Dict, Any, Optional
-import wave
+from typing import Dict, Any, Optional, List, Tuple
+import gc
+import struct
 import os
 os.environ['KMP_DUPLICATE_LIB_OK']='True' # IDK why but adding this ignores a weird issue where libomp.dylib is loaded twice on MacOS, might cause issues
-from TTS.api import TTS
+import numpy as np
+import soundfile as sf
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from TTS.api import TTS
+
+
+def _wav_header_duration(path: str | Path) -> float:
+    """
+    Duration from the RIFF header alone (fmt + data chunk sizes), no sample data is read.
+    Unlike the wave module this also handles float / WAVE_FORMAT_EXTENSIBLE files.
+    """
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise ValueError(f"Not a RIFF/WAVE file: {path}")
+
+        sample_rate = block_align = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(size)
+                _, _, sample_rate, _, block_align = struct.unpack("<HHIIH", fmt[:14])
+                f.seek(size % 2, 1)  # chunks are word aligned
+            elif chunk_id == b"data":
+                if not sample_rate or not block_align:
+                    raise ValueError(f"WAV data chunk before fmt chunk: {path}")
+                return size / float(sample_rate * block_align)
+            else:
+                f.seek(size + size % 2, 1)
+
+    raise ValueError(f"No data chunk found in WAV file: {path}")
 
 
 def wav_duration_seconds(path: str) -> float:
-    with wave.open(path, "rb") as w:
-        frames = w.getnframes()
-        rate = w.getframerate()
-    return frames / float(rate)
+    return _wav_header_duration(path)
 
 
 def build_narration_text(spec: Dict[str, Any]) -> str:
     """
     Combines all scene texts into one narration string.
     """
-    parts = []
-    for s in spec.get("scenes", []):
-        t = (s.get("text") or "").strip()
-        if not t:
-            continue
-        parts.append(t)
+    texts = ((s.get("text") or "").strip() for s in spec.get("scenes", []))
+    return " ".join(t for t in texts if t)
+
+
+# silence Coqui's Synthesizer.tts appends after every sentence, kept so the pacing matches tts_to_file
+_SENTENCE_GAP_SAMPLES = 10000
+
+# (model_name, gpu) -> loaded TTS model, shared by every CoquiVoiceover in this process
+_TTS_CACHE: Dict[Tuple[str, bool], TTS] = {}
 
-    return " ".join(parts)
+
+def _get_tts(model_name: str, gpu: bool) -> TTS:
+    key = (model_name, gpu)
+    if key not in _TTS_CACHE:
+        # imported here, pulling in Coqui (and torch) takes seconds and not every caller needs the model
+        from TTS.api import TTS
+        _TTS_CACHE[key] = TTS(model_name=model_name, progress_bar=True, gpu=gpu)
+    return _TTS_CACHE[key]
 
 
 class CoquiVoiceover:
@@ -44,7 +86,49 @@ class CoquiVoiceover:
         # device selection:
         # - if device is None, Coqui chooses automatically
         self.model_name = model_name
-        self.tts = TTS(model_name=model_name, progress_bar=True, gpu=(device == "cuda"))
+        self._cache_key = (model_name, device == "cuda")
+        self.tts = _get_tts(model_name, gpu=(device == "cuda"))
+        # speaker -> (gpt_cond_latent, speaker_embedding), filled lazily by _get_conds
+        self._cond_cache: Dict[str, Tuple[Any, Any]] = {}
+
+    def release(self) -> None:
+        """
+        Drops the model from _TTS_CACHE and frees its GPU memory, so the next GPU stage
+        (eg: image generation) doesn't have to share the card with an idle XTTS.
+        The instance can't generate anymore after this.
+        """
+        _TTS_CACHE.pop(self._cache_key, None)
+        self.tts = None
+        self._cond_cache.clear()
+        gc.collect()
+        import torch  # already loaded by Coqui at this point
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    @property
+    def sample_rate(self) -> int:
+        """
+        Output sample rate of the wavs written by generate_many.
+        """
+        return self.tts.synthesizer.tts_model.config.audio.output_sample_rate
+
+    def _get_conds(self, speaker: str) -> Tuple[Any, Any]:
+        """
+        Returns the XTTS conditioning latents for a speaker, computing them only once.
+
+        speaker can be a built-in speaker name or a path to a reference wav.
+        """
+        if speaker not in self._cond_cache:
+            model = self.tts.synthesizer.tts_model
+            speakers = model.speaker_manager.speakers
+            if speaker in speakers:
+                conds = (speakers[speaker]["gpt_cond_latent"], speakers[speaker]["speaker_embedding"])
+            elif Path(speaker).is_file():
+                conds = model.get_conditioning_latents(audio_path=[speaker])
+            else:
+                raise ValueError(f"Unknown speaker: {speaker}")
+            self._cond_cache[speaker] = conds
+        return self._cond_cache[speaker]
 
     def generate(
         self,
@@ -53,21 +137,24 @@ class CoquiVoiceover:
         *,
         speaker: Optional[str] = "Craig Gutsy",
         language: Optional[str] = "en",
+        text: Optional[str] = None,
     ) -> Path:
         """
         Generates narration.wav from the YAML spec.
 
         speaker/language are optional and only work if the model supports them, the default for this class supports it.
+        text can be passed if build_narration_text(spec) was already computed by the caller.
         """
 
         out_wav_path = Path(out_wav_path)
         out_wav_path.parent.mkdir(parents=True, exist_ok=True)
 
-        text = build_narration_text(spec)
+        if text is None:
+            text = build_narration_text(spec)
         if not text.strip():
             raise ValueError("No narration text found in spec scenes.")
 
-        self.tts.tts_to_file(text=text, speaker=speaker, language=language, file_path=out_wav_path)
+        self.generate_many([text], [out_wav_path], speaker=speaker, language=language)
 
         return out_wav_path
     def generate_one(
@@ -85,13 +172,64 @@ class CoquiVoiceover:
         out_wav_path = Path(out_wav_path)
         out_wav_path.parent.mkdir(parents=True, exist_ok=True)
 
-        if not text.strip():
-            raise ValueError("No narration text found.")
-
-        self.tts.tts_to_file(text=text, speaker=speaker, language=language, file_path=out_wav_path)
+        self.generate_many([text], [out_wav_path], speaker=speaker, language=language)
 
         return out_wav_path
 
+    def generate_many(
+        self,
+        texts: List[str],
+        out_wav_paths: List[str | Path],
+        *,
+        speaker: Optional[str] = "Craig Gutsy",
+        language: Optional[str] = "en",
+    ) -> List[np.ndarray]:
+        """
+        Generates one wav per text (eg: one per scene) with a single speaker conditioning.
+
+        Same output as tts_to_file: the text is split into sentences, each one is synthesized with the
+        sampling settings from the model config and followed by _SENTENCE_GAP_SAMPLES of silence,
+        and the wav is written through the Synthesizer (peak normalized 16 bit).
+        Only the speaker latents are reused, which saves the conditioning pass for reference-wav speakers.
+        Returns the (variable length) waveforms in input order.
+        """
+        if len(texts) != len(out_wav_paths):
+            raise ValueError("texts and out_wav_paths must have the same length.")
+
+        synthesizer = self.tts.synthesizer
+        model = synthesizer.tts_model
+        gpt_cond_latent, speaker_embedding = self._get_conds(speaker)
+        settings = {
+            "temperature": model.config.temperature,
+            "length_penalty": model.config.length_penalty,
+            "repetition_penalty": model.config.repetition_penalty,
+            "top_k": model.config.top_k,
+            "top_p": model.config.top_p,
+        }
+        gap = np.zeros(_SENTENCE_GAP_SAMPLES, dtype=np.float32)
+
+        wavs: List[np.ndarray] = []
+        for text, out_wav_path in zip(texts, out_wav_paths):
+            if not text.strip():
+                raise ValueError("No narration text found.")
+
+            out_wav_path = Path(out_wav_path)
+            out_wav_path.parent.mkdir(parents=True, exist_ok=True)
+
+            pieces: List[np.ndarray] = []
+            for sentence in synthesizer.split_into_sentences(text):
+                out = model.inference(sentence, language, gpt_cond_latent, speaker_embedding, **settings)
+                wav = out["wav"]
+                if hasattr(wav, "cpu"):
+                    wav = wav.cpu().numpy()
+                pieces.append(np.asarray(wav, dtype=np.float32).reshape(-1))
+                pieces.append(gap)
+            wav = np.concatenate(pieces)
+            synthesizer.save_wav(wav, str(out_wav_path))
+            wavs.append(wav)
+
+        return wavs
+
 if __name__ == "__main__":
     print("Testing TTS model...")
     testmodel = CoquiVoiceover()
@@ -1,20 +1,62 @@
 # run bgm gen audiocraft commands in 3.9 conda
 # conda activate bgmgen39
+import atexit
+import json
 import subprocess
 import os
+from pathlib import Path
+
+# Interpreter of the audiocraftenv conda env, override with the AUDIOCRAFT_PY env var
+AUDIOCRAFT_PY = Path(os.environ.get("AUDIOCRAFT_PY", Path.home() / "miniconda3" / "envs" / "audiocraftenv" / "bin" / "python"))
+
+# Long-lived worker, models stay loaded between generate_bgm calls
+_WORKER: subprocess.Popen | None = None
+
+#command to start bgm_gen_worker.py as a daemon, jobs are sent as one JSON line each on stdin
+# <audiocraftenv python> bgm_gen_worker.py --daemon
+def _get_worker() -> subprocess.Popen:
+    global _WORKER
+    if _WORKER is None or _WORKER.poll() is not None:
+        if AUDIOCRAFT_PY.exists():
+            # env's python directly, skips conda's activation overhead
+            command = [str(AUDIOCRAFT_PY), "bgm_gen_worker.py", "--daemon"]
+        else:
+            command = [
+                "conda", "run", "--no-capture-output", "-n", "audiocraftenv",
+                "python", "bgm_gen_worker.py", "--daemon",
+            ]
+        print(f"[bgm_gen] Starting worker: {' '.join(command)}")
+        _WORKER = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+    return _WORKER
+
+
+def _stop_worker() -> None:
+    global _WORKER
+    if _WORKER is not None and _WORKER.poll() is None:
+        _WORKER.stdin.close()
+        _WORKER.wait()
+    _WORKER = None
+
+
+atexit.register(_stop_worker)
+
 
-#command to run bgm_gen_worker.py with args
-# conda run -n audiocraftenv python bgm_gen_worker.py --prompt "A calm and soothing background music with gentle piano and soft strings, perfect for relaxation and meditation." --output "output_music.wav" --duration 30
 def generate_bgm(prompt: str, output_file: str, duration: float =30) -> None:
-    command = [
-        "conda", "run", "--no-capture-output", "-n", "audiocraftenv",
-        "python", "bgm_gen_worker.py",
-        "--prompt", prompt,
-        "--output", output_file,
-        "--duration", str(int(duration)+1)
-    ]
-    print(f"[bgm_gen] Running command: {' '.join(command)}")
-    result = subprocess.run(command, check=True,stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    worker = _get_worker()
+    req = {"prompt": prompt, "output": output_file, "duration": int(duration)+1}
+    worker.stdin.write(json.dumps(req) + "\n")
+    worker.stdin.flush()
+
+    # Skip anything that isn't a JSON reply (eg: library logs printed to stdout)
+    while True:
+        line = worker.stdout.readline()
+        if not line:
+            raise RuntimeError("[bgm_gen] worker exited before replying")
+        if line.startswith("{"):
+            resp = json.loads(line)
+            break
+    if "error" in resp:
+        raise RuntimeError(f"[bgm_gen] worker failed: {resp['error']}")
     print(f"[bgm_gen] Generated music saved to {output_file}")
 
 if __name__ == "__main__":
@@ -22,4 +64,4 @@ if __name__ == "__main__":
     test_prompt = "\"A calm and soothing background music with gentle piano and soft strings, perfect for relaxation and meditation.\""
     test_output = "test_output_music.wav"
     generate_bgm(test_prompt, test_output, duration=5)
-    print("BGM generation test completed.")
\ No newline at end of file
+    print("BGM generation test completed.")
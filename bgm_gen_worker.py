@@ -1,46 +1,69 @@
 # Worker that exposes audiocraft inputs to CLI for calling from another env
+# Run with --daemon to keep the models loaded and read one JSON job per line from stdin:
+#   {"prompt": "...", "output": "out.wav", "duration": 30}  ->  {"ok": "out.wav"} / {"error": "..."}
 import warnings
 warnings.filterwarnings("ignore")
 from audiocraft.models import MusicGen # type: ignore
 from audiocraft.models import MultiBandDiffusion # type: ignore
 import argparse
+import json
+import sys
+import soundfile as sf
+import torch
 # Add arguments for prompt and output file and duration
 
 parser = argparse.ArgumentParser(description='Generate background music using MusicGen.')
-parser.add_argument('--prompt', type=str, required=True, help='Text prompt for music generation')
-parser.add_argument('--output', type=str, required=True, help='Output file path for the generated music')
+parser.add_argument('--prompt', type=str, help='Text prompt for music generation')
+parser.add_argument('--output', type=str, help='Output file path for the generated music')
 parser.add_argument('--duration', type=int, default=30, help='Duration of the generated music in seconds')
+parser.add_argument('--daemon', action='store_true', help='Keep models loaded and serve JSON jobs from stdin')
 args = parser.parse_args()
-print(f"[bgm_gen_worker] Generating music with prompt: {args.prompt}, duration: {args.duration}s, output: {args.output}")
+if not args.daemon and (args.prompt is None or args.output is None):
+    parser.error('--prompt and --output are required unless --daemon is given')
+
 USE_DIFFUSION_DECODER = True
 # Using small model, better results would be obtained with `medium` or `large`.
 model = MusicGen.get_pretrained('facebook/musicgen-small')
 if USE_DIFFUSION_DECODER:
     mbd = MultiBandDiffusion.get_mbd_musicgen()
-    
-
-model.set_generation_params(
-    use_sampling=True,
-    top_k=250,
-    duration=args.duration
-)
-
-from audiocraft.utils.notebook import display_audio # type: ignore
-
-output = model.generate(
-    descriptions=[
-        args.prompt
-    ],
-    progress=False, return_tokens=True
-)
-# display_audio(output[0], sample_rate=32000)
-finOut = output[0]
-if USE_DIFFUSION_DECODER:
-    out_diffusion = mbd.tokens_to_wav(output[1])
-    finOut = out_diffusion
-    # display_audio(out_diffusion, sample_rate=32000)
 
 
-import soundfile as sf
-sf.write(args.output, finOut.detach().numpy().squeeze(0).squeeze(0), 32000)
-print(f"[bgm_gen_worker] Generated music saved to {args.output}")
\ No newline at end of file
+def run(prompt: str, output_file: str, duration: int) -> None:
+    # logs go to stderr so stdout stays a clean JSON channel in daemon mode
+    print(f"[bgm_gen_worker] Generating music with prompt: {prompt}, duration: {duration}s, output: {output_file}", file=sys.stderr)
+    model.set_generation_params(
+        use_sampling=True,
+        top_k=250,
+        duration=duration
+    )
+
+    output = model.generate(
+        descriptions=[
+            prompt
+        ],
+        progress=False, return_tokens=True
+    )
+    finOut = output[0]
+    if USE_DIFFUSION_DECODER:
+        out_diffusion = mbd.tokens_to_wav(output[1])
+        finOut = out_diffusion
+
+    # single host copy (works for CUDA tensors too), 16 bit PCM is plenty for BGM mixed at 0.2 volume
+    wav = finOut.detach().to("cpu", torch.float32).squeeze().numpy()
+    sf.write(output_file, wav, 32000, subtype="PCM_16")
+    print(f"[bgm_gen_worker] Generated music saved to {output_file}", file=sys.stderr)
+
+
+if args.daemon:
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            req = json.loads(line)
+            run(req["prompt"], req["output"], int(req.get("duration", 30)))
+            resp = {"ok": req["output"]}
+        except Exception as e:
+            resp = {"error": str(e)}
+        print(json.dumps(resp), flush=True)
+else:
+    run(args.prompt, args.output, args.duration)
@@ -2,16 +2,62 @@
 from __future__ import annotations
 
 import subprocess
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 
-ALLOWED_MOTIONS = {"slow_zoom", "pan_left", "pan_right", "static"}
+ALLOWED_MOTIONS = frozenset({"slow_zoom", "pan_left", "pan_right", "static"})
 
 
 def _run(cmd: List[str]) -> None:
     subprocess.run(cmd, check=True)
 
 
+# Preferred H.264 encoders, hardware first
+_HW_ENCODERS = ["h264_nvenc", "h264_videotoolbox", "h264_qsv"]
+
+
+@lru_cache(maxsize=1)
+def _pick_venc() -> str:
+    """
+    Probes ffmpeg once for a working hardware H.264 encoder, falls back to libx264.
+    """
+    try:
+        out = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            check=True, capture_output=True, text=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "libx264"
+
+    available = {line.split()[1] for line in out.splitlines() if len(line.split()) > 1}
+    for enc in _HW_ENCODERS:
+        if enc not in available:
+            continue
+        # Listed encoders can still lack the hardware, so try a tiny encode
+        probe = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error",
+             "-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1",
+             "-c:v", enc, "-f", "null", "-"],
+            capture_output=True,
+        )
+        if probe.returncode == 0:
+            return enc
+    return "libx264"
+
+
+def _venc_args() -> List[str]:
+    """
+    -c:v args (plus encoder specific quality settings) for the picked encoder.
+    """
+    venc = _pick_venc()
+    if venc == "h264_nvenc":
+        return ["-c:v", venc, "-preset", "p5", "-rc", "vbr", "-cq", "23"]
+    if venc == "h264_videotoolbox":
+        return ["-c:v", venc, "-q:v", "60"]
+    return ["-c:v", venc]
+
+
 def _scene_motion_vf(
     motion: str,
     duration: float,
@@ -61,31 +107,34 @@ def _scene_motion_vf(
         )
         return vf
 
+    # Pans: scale once to a 1.03x canvas (same framing as the old zoompan z=1.03)
+    # and slide a fixed out_w x out_h crop window across it, no per-frame resample
+    pan_w = int(out_w * 1.03)
+    pan_h = int(out_h * 1.03)
+    pan_base = (
+        f"scale={pan_w}:{pan_h}:force_original_aspect_ratio=increase,"
+        f"crop={pan_w}:{pan_h},"
+        f"fps={fps},"
+    )
+    progress = f"min(1,t/{duration})"
+
     if motion == "pan_left":
         vf = (
-            f"{base}"
-            f"zoompan="
-            f"z='1.03':"
-            f"x='max(0,(iw-iw/zoom)*(1-on/{frames}))':"
-            f"y='ih/2-(ih/zoom/2)':"
-            f"d={frames}:"
-            f"s={out_w}x{out_h}:"
-            f"fps={fps},"
-            f"fps={fps},format=yuv420p"
+            f"{pan_base}"
+            f"crop={out_w}:{out_h}:"
+            f"x='(iw-ow)*(1-{progress})':"
+            f"y='(ih-oh)/2',"
+            f"format=yuv420p"
         )
         return vf
 
     if motion == "pan_right":
         vf = (
-            f"{base}"
-            f"zoompan="
-            f"z='1.03':"
-            f"x='max(0,(iw-iw/zoom)*(on/{frames}))':"
-            f"y='ih/2-(ih/zoom/2)':"
-            f"d={frames}:"
-            f"s={out_w}x{out_h}:"
-            f"fps={fps},"
-            f"fps={fps},format=yuv420p"
+            f"{pan_base}"
+            f"crop={out_w}:{out_h}:"
+            f"x='(iw-ow)*{progress}':"
+            f"y='(ih-oh)/2',"
+            f"format=yuv420p"
         )
         return vf
 
@@ -93,99 +142,123 @@ def _scene_motion_vf(
     return f"{base}scale={out_w}:{out_h},fps={fps},format=yuv420p"
 
 
-def _render_scene_clip(
-    img_path: Path,
-    out_clip: Path,
+def _render_final(
+    img_paths: List[Path],
+    durations: List[float],
+    motions: List[str],
+    out_path: Path,
     *,
-    duration: float,
-    motion: str,
     width: int,
     height: int,
     fps: int,
+    crossfade_dur: float,
+    audio_wav: Path,
+    subtitles_ass: Path,
+    bgm_wav: Path | None = None,
 ) -> None:
-    out_clip.parent.mkdir(parents=True, exist_ok=True)
+    """
+    Renders the final video with one ffmpeg call and a single video encode:
+    still images -> motion + crossfades -> burned subtitles, muxed with the
+    narration (mixed with BGM if given).
+    No intermediate per-scene videos are encoded or decoded.
+    """
+    out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    vf = _scene_motion_vf(
-        motion=motion,
-        duration=duration,
-        out_w=width,
-        out_h=height,
+    inputs: List[str] = []
+    for img_path, dur in zip(img_paths, durations):
+        inputs += ["-loop", "1", "-t", str(dur), "-i", str(img_path)]
+
+    # Audio: narration, optionally mixed with BGM
+    inputs += ["-i", str(audio_wav)]
+    if bgm_wav is not None:
+        inputs += ["-i", str(bgm_wav)]
+
+    filter_complex, audio_map = _final_filtergraph(
+        durations,
+        motions,
+        width=width,
+        height=height,
         fps=fps,
+        crossfade_dur=crossfade_dur,
+        subtitles_ass=subtitles_ass,
+        with_bgm=bgm_wav is not None,
     )
 
-    # output CFR clip, exact duration
     cmd = [
         "ffmpeg", "-y",
-        "-loop", "1",
-        "-i", str(img_path),
-        "-t", str(duration),
-        "-vf", vf,
+        *inputs,
+        "-filter_complex", filter_complex,
+        "-map", "[vout]",
+        "-map", audio_map,
         "-r", str(fps),
-        "-c:v", "libx264",
+        *_venc_args(),
         "-pix_fmt", "yuv420p",
-        str(out_clip),
+        "-c:a", "aac",
+        "-shortest",
+        str(out_path),
     ]
     _run(cmd)
 
 
-def _xfade_clips(
-    clip_paths: List[Path],
+def _final_filtergraph(
     durations: List[float],
-    out_path: Path,
+    motions: List[str],
     *,
+    width: int,
+    height: int,
     fps: int,
     crossfade_dur: float,
-) -> None:
+    subtitles_ass: Path,
+    with_bgm: bool,
+) -> Tuple[str, str]:
     """
-    Crossfade N mp4 clips using xfade.
+    filter_complex for _render_final. Inputs are expected as one looped still per scene,
+    then the narration wav, then the BGM wav (if with_bgm).
+    Returns (filter_complex, audio map target).
     """
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-
-    inputs: List[str] = []
-    for p in clip_paths:
-        inputs += ["-i", str(p)]
-
-    n = len(clip_paths)
-    if n == 1:
-        cmd = [
-            "ffmpeg", "-y",
-            "-i", str(clip_paths[0]),
-            "-c:v", "copy",
-            str(out_path),
-        ]
-        _run(cmd)
-        return
-
-    # Build filtergraph: [0:v][1:v]xfade... and then chain
-    # Offsets based on timeline
+    # Per-scene motion branches, trimmed to the exact scene duration.
+    # No setpts here: the looped stills already start at 0, and setpts drops the frame rate
+    # (1/0 on ffmpeg 7) which xfade rejects as non constant.
     parts = []
-    offset = max(0.0, durations[0] - crossfade_dur)
-    parts.append(f"[0:v][1:v]xfade=transition=fade:duration={crossfade_dur}:offset={offset}[v1]")
-
-    timeline = durations[0]
-    cur = "v1"
-
-    for i in range(2, n):
-        timeline = timeline + durations[i - 1] - crossfade_dur
-        offset = max(0.0, timeline - crossfade_dur)
-        nxt = f"v{i}"
-        parts.append(f"[{cur}][{i}:v]xfade=transition=fade:duration={crossfade_dur}:offset={offset}[{nxt}]")
-        cur = nxt
-
-    parts.append(f"[{cur}]fps={fps},format=yuv420p[vout]")
-    filter_complex = ";".join(parts)
-
-    cmd = [
-        "ffmpeg", "-y",
-        *inputs,
-        "-filter_complex", filter_complex,
-        "-map", "[vout]",
-        "-r", str(fps),
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
-        str(out_path),
-    ]
-    _run(cmd)
+    for i, (dur, motion) in enumerate(zip(durations, motions)):
+        vf = _scene_motion_vf(
+            motion=motion,
+            duration=dur,
+            out_w=width,
+            out_h=height,
+            fps=fps,
+        )
+        parts.append(f"[{i}:v]{vf},trim=duration={dur}[s{i}]")
+
+    n = len(durations)
+    cur = "s0"
+    if n > 1 and crossfade_dur <= 0:
+        # Hard cuts, plain concat instead of zero length xfades
+        branches = "".join(f"[s{i}]" for i in range(n))
+        parts.append(f"{branches}concat=n={n}:v=1:a=0[vcat]")
+        cur = "vcat"
+    else:
+        # Crossfade chain, offsets based on timeline (single scene goes straight through)
+        timeline = durations[0]
+        for i in range(1, n):
+            if i > 1:
+                timeline = timeline + durations[i - 1] - crossfade_dur
+            offset = max(0.0, timeline - crossfade_dur)
+            nxt = f"v{i}"
+            parts.append(f"[{cur}][s{i}]xfade=transition=fade:duration={crossfade_dur}:offset={offset}[{nxt}]")
+            cur = nxt
+
+    parts.append(f"[{cur}]fps={fps},format=yuv420p,ass={subtitles_ass}[vout]")
+
+    a_idx = n
+    audio_map = f"{a_idx}:a"
+    if with_bgm:
+        parts.append(f"[{a_idx}:a]volume=1[fg]")
+        parts.append(f"[{a_idx + 1}:a]volume=0.2[bg]")
+        parts.append("[fg][bg]amix=inputs=2:duration=longest[aout]")
+        audio_map = "[aout]"
+
+    return ";".join(parts), audio_map
 
 def override_ass_style(
     in_ass: Path,
@@ -201,8 +274,6 @@ def override_ass_style(
     """
     Modifies the 'Style: Default,...' line in the ASS file.
     """
-    txt = in_ass.read_text(encoding="utf-8")
-
     def repl_style_line(line: str) -> str:
         # ASS style format used:
         # Style: Default,Fontname,Fontsize,PrimaryColour,SecondaryColour,OutlineColour,BackColour,Bold,Italic,Underline,StrikeOut,ScaleX,ScaleY,Spacing,Angle,BorderStyle,Outline,Shadow,Alignment,MarginL,MarginR,MarginV,Encoding
@@ -230,12 +301,15 @@ def override_ass_style(
 
         return ",".join(parts)
 
-    out_lines = []
-    for line in txt.splitlines():
-        out_lines.append(repl_style_line(line))
-
+    # Stream line by line, only the style line is rewritten
     out_ass.parent.mkdir(parents=True, exist_ok=True)
-    out_ass.write_text("\n".join(out_lines) + "\n", encoding="utf-8")
+    with in_ass.open("r", encoding="utf-8") as fin, out_ass.open("w", encoding="utf-8") as fout:
+        for line in fin:
+            if line.startswith("Style: Default,"):
+                line = repl_style_line(line.rstrip("\n")) + "\n"
+            elif not line.endswith("\n"):
+                line += "\n"
+            fout.write(line)
 
 
 def compose_final_video(
@@ -268,10 +342,6 @@ def compose_final_video(
     out_path = Path(out_path)
     work_dir = Path(work_dir)
 
-    clips_dir = work_dir / "clips"
-    slideshow_mp4 = work_dir / "slideshow.mp4"
-    av_mp4 = work_dir / "slideshow_with_audio.mp4"
-
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
     if not audio_wav.exists():
@@ -279,56 +349,26 @@ def compose_final_video(
     if not subtitles_ass.exists():
         raise FileNotFoundError(f"Missing subtitles file: {subtitles_ass}")
 
-    # 1) Render each scene as its own CFR mp4
-    clip_paths: List[Path] = []
+    if bgm_enabled and not bgm_output:
+        raise ValueError("BGM output path must be specified when BGM is enabled.")
+
+    # 1) Collect scene images, durations and motions
+    img_paths: List[Path] = []
     durations: List[float] = []
+    motions: List[str] = []
 
     for s in scenes:
         sid = s["id"]
-        dur = float(s["duration"])
-        durations.append(dur)
+        durations.append(float(s["duration"]))
 
         img_path = images_dir / f"{sid}.png"
         if not img_path.exists():
             raise FileNotFoundError(f"Missing scene image: {img_path}")
+        img_paths.append(img_path)
 
-        motion = (s.get("visual") or {}).get("motion") or "slow_zoom"
-        clip_path = clips_dir / f"{sid}.mp4"
+        motions.append((s.get("visual") or {}).get("motion") or "slow_zoom")
 
-        _render_scene_clip(
-            img_path=img_path,
-            out_clip=clip_path,
-            duration=dur,
-            motion=motion,
-            width=width,
-            height=height,
-            fps=fps,
-        )
-
-        clip_paths.append(clip_path)
-
-    # 2) Crossfade clips into slideshow.mp4
-    _xfade_clips(
-        clip_paths=clip_paths,
-        durations=durations,
-        out_path=slideshow_mp4,
-        fps=fps,
-        crossfade_dur=crossfade_dur,
-    )
-
-    # 3) Add narration audio
-    cmd_audio = [
-        "ffmpeg", "-y",
-        "-i", str(slideshow_mp4),
-        "-i", str(audio_wav),
-        "-c:v", "copy",
-        "-c:a", "aac",
-        "-shortest",
-        str(av_mp4),
-    ]
-    _run(cmd_audio)
-
-    # # 4) Burn subtitles with forced font
+    # 2) Subtitles with forced font
 
     subtitles_for_burn = subtitles_ass
 
@@ -353,26 +393,19 @@ def compose_final_video(
             bold=1,
         )
 
-    vf_subs = f"ass={subtitles_for_burn}"
-
-    if bgm_enabled: bgm_before_fin = work_dir / "before_bgm.mp4"
-    cmd_subs = [
-        "ffmpeg", "-y",
-        "-i", str(av_mp4),
-        "-vf", vf_subs,
-        "-c:v", "libx264",
-        "-pix_fmt", "yuv420p",
-        "-c:a", "copy",
-        str(out_path) if not bgm_enabled else str(bgm_before_fin),
-    ]
-    _run(cmd_subs)
-
-    if bgm_enabled:
-        if not bgm_output:
-            raise ValueError("BGM output path must be specified when BGM is enabled.")
-        cmd_add_bgm = [
-            "ffmpeg", "-i", str(bgm_before_fin), "-i", str(bgm_output), "-filter_complex", "[0:a]volume=1[fg]; [1:a]volume=0.2[bg]; [fg][bg]amix=inputs=2:duration=longest","-c:v", "copy", str(out_path)
-        ]
-        _run(cmd_add_bgm)
+    # 3) Slideshow + subtitles + narration (+ BGM) in a single ffmpeg pass
+    _render_final(
+        img_paths=img_paths,
+        durations=durations,
+        motions=motions,
+        out_path=out_path,
+        width=width,
+        height=height,
+        fps=fps,
+        crossfade_dur=crossfade_dur,
+        audio_wav=audio_wav,
+        subtitles_ass=subtitles_for_burn,
+        bgm_wav=bgm_output if bgm_enabled else None,
+    )
 
     return out_path
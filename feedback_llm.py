@@ -1,20 +1,29 @@
+import sys
 import yaml
 from pathlib import Path
 
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
 # ---------- CONFIG ----------
 LLM_MODEL = "llama3.1:8b"  # or anyother model name
 PATCH_OUTPUT = Path("build/video_patch.yaml")
 
 # ---------- LLM CALL FUNCTION ----------
-def call_llm(system_prompt: str, user_prompt: str, *, seed: int | None = None, temperature: float | None = None) -> str:
+def call_llm(system_prompt: str, user_prompt: str, *, seed: int | None = None, temperature: float | None = None, stream: bool = False) -> str:
+    """
+    stream=True also echoes tokens to stdout as they arrive (for interactive use).
+    """
     from ollama import chat
-    from ollama import ChatResponse
     options = {}
     if seed is not None:
         options["seed"] = int(seed)
     if temperature is not None:
         options["temperature"] = float(temperature)
-    response: ChatResponse = chat(model=LLM_MODEL, messages=[
+    # Streamed, tokens are consumed as the model produces them instead of one buffered reply
+    chunks = chat(model=LLM_MODEL, messages=[
         {
             'role': 'system',
             'content': system_prompt,
@@ -24,8 +33,17 @@ def call_llm(system_prompt: str, user_prompt: str, *, seed: int | None = None, t
             'content': user_prompt,
         },
 
-    ], options=options if options else None)
-    return response['message']['content']
+    ], options=options if options else None, stream=True)
+    parts = []
+    for chunk in chunks:
+        content = chunk['message']['content']
+        parts.append(content)
+        if stream:
+            sys.stdout.write(content)
+            sys.stdout.flush()
+    if stream:
+        sys.stdout.write("\n")
+    return "".join(parts)
 
 
 # ---------- MAIN CODE ----------
@@ -93,10 +111,11 @@ OUTPUT:
 
     response = call_llm(system_prompt, user_prompt,seed=seed,  temperature=temperature)
 
-    # Basic sanity check
+    # Basic sanity check, syntax only: walk the parser events without building objects
     try:
-        yaml.safe_load(response)
-    except Exception as e:
+        for _ in yaml.parse(response, Loader=_Loader):
+            pass
+    except yaml.YAMLError as e:
         raise RuntimeError("LLM output is not valid YAML") from e
 
     PATCH_OUTPUT.write_text(response)
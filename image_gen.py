@@ -1,8 +1,10 @@
 # image_gen.py
 from __future__ import annotations
 
+import gc
+import threading
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 import torch
 from diffusers import StableDiffusionPipeline, EulerAncestralDiscreteScheduler, ZImagePipeline
@@ -11,6 +13,9 @@ from diffusers import StableDiffusionPipeline, EulerAncestralDiscreteScheduler,
 # DEFAULT_MODEL = "stable-diffusion-v1-5/stable-diffusion-v1-5" # CAN TRY ANY OTHER MODEL FROM HUGGINGFACE
 DEFAULT_MODEL = "Tongyi-MAI/Z-Image-Turbo"
 
+# Rough VRAM needed per image in a batch at 720x1280 (activations only, weights excluded), scaled by pixel count
+_BYTES_PER_IMAGE_720P = 3 * 1024**3
+
 
 def pick_device() -> str:
     if torch.cuda.is_available():
@@ -20,6 +25,52 @@ def pick_device() -> str:
     return "cpu"
 
 
+# (model_id, device, dtype, compile_transformer) -> loaded pipeline, shared by every ImageGenerator in this process
+_PIPE_CACHE: Dict[tuple, ZImagePipeline] = {}
+
+
+def _get_pipe(model_id: str, device: str, dtype: torch.dtype, compile_transformer: bool = False) -> ZImagePipeline:
+    """
+    Loads and configures the pipeline once per (model_id, device, dtype, compile_transformer), later calls reuse it.
+    """
+    key = (model_id, device, str(dtype), compile_transformer)
+    if key in _PIPE_CACHE:
+        return _PIPE_CACHE[key]
+
+    pipe = ZImagePipeline.from_pretrained(
+        model_id,
+        torch_dtype=dtype,
+        low_cpu_mem_usage=(device == "cuda"),
+    )
+
+    pipe = pipe.to(device)
+    pipe.set_progress_bar_config(disable=True)
+
+    # Memory optimizations
+    # VAE tiling/slicing keeps the 720x1280 decode from spiking memory
+    if hasattr(pipe, "vae"):
+        pipe.vae.enable_tiling()
+        pipe.vae.enable_slicing()
+
+    if device == "cuda":
+        # Fused attention kernels: xformers if installed, else torch SDPA (flash/mem-efficient) which diffusers uses by default.
+        # Attention slicing is skipped here since it replaces those kernels with a slower sliced loop.
+        try:
+            pipe.enable_xformers_memory_efficient_attention()
+        except Exception:
+            pass
+        # Opt-in: the compile is only worth it when the cached pipeline is reused across many batches.
+        # It happens lazily on the first denoise, ImageGenerator._denoise falls back to eager if it fails there.
+        # Default mode, reduce-overhead would capture new CUDA graphs for every batch size.
+        if compile_transformer and hasattr(pipe, "transformer"):
+            pipe.transformer = torch.compile(pipe.transformer, fullgraph=False)
+    else:
+        pipe.enable_attention_slicing()
+
+    _PIPE_CACHE[key] = pipe
+    return pipe
+
+
 class ImageGenerator:
     """
     Keeps the pipeline loaded in memory
@@ -31,8 +82,11 @@ class ImageGenerator:
         model_id: str = DEFAULT_MODEL,
         device: Optional[str] = None,
         dtype: Optional[torch.dtype] = None,
+        compile_transformer: bool = False,  # torch.compile the transformer (CUDA only)
     ):
         self.device = device or pick_device()
+        # Nothing here trains, no autograd bookkeeping needed (grad mode is per thread)
+        torch.set_grad_enabled(False)
 
         # if dtype is None:
         #     if self.device in ("cuda", "mps"):
@@ -40,7 +94,7 @@ class ImageGenerator:
         #     else:
         #         dtype = torch.float32
         if dtype is None:
-            dtype = torch.float32
+            dtype = torch.bfloat16
 
         # self.pipe = StableDiffusionPipeline.from_pretrained(
         #     model_id,
@@ -50,21 +104,122 @@ class ImageGenerator:
         # )
 
         # self.pipe.scheduler = EulerAncestralDiscreteScheduler.from_config(self.pipe.scheduler.config)
-        self.pipe = ZImagePipeline.from_pretrained(
-            model_id,
-            torch_dtype=torch.bfloat16,
-            low_cpu_mem_usage=False,
-        )
+        self._cache_key = (model_id, self.device, str(dtype), compile_transformer)
+        self.pipe = _get_pipe(model_id, self.device, dtype, compile_transformer)
 
-        self.pipe = self.pipe.to(self.device)
-
-        # Memory optimizations
-        self.pipe.enable_attention_slicing()
+    def release(self) -> None:
+        """
+        Drops the pipeline from _PIPE_CACHE and frees its GPU memory, so the next GPU stage
+        (eg: TTS) doesn't have to share the card with an idle diffusion model.
+        The instance can't generate anymore after this.
+        """
+        _PIPE_CACHE.pop(self._cache_key, None)
+        self.pipe = None
+        gc.collect()
         if self.device == "cuda":
+            torch.cuda.empty_cache()
+
+    def _generators(self, seeds: Optional[List[int]]) -> Optional[List[torch.Generator]]:
+        if seeds is None:
+            return None
+        return [torch.Generator(device=self.device).manual_seed(s) for s in seeds]
+
+    def _denoise(self, seeds: Optional[List[int]], **kwargs) -> List[Any]:
+        """
+        Runs the pipeline with one generator per seed. If a compiled transformer fails (eg: triton missing),
+        it is swapped back to the eager module once and the call is retried with fresh generators.
+        """
+        try:
+            return self.pipe(generator=self._generators(seeds), **kwargs).images
+        except torch.cuda.OutOfMemoryError:
+            raise
+        except Exception as e:
+            eager = getattr(self.pipe.transformer, "_orig_mod", None)
+            if eager is None:
+                raise
+            print(f"[image_gen] compiled transformer failed ({e!r}), falling back to eager")
+            self.pipe.transformer = eager
+            return self.pipe(generator=self._generators(seeds), **kwargs).images
+
+    def _auto_batch_size(self, width: int, height: int) -> int:
+        """
+        Picks how many images fit in one denoise from the free VRAM (CUDA only, else 1).
+        """
+        if self.device != "cuda":
+            return 1
+        free, _ = torch.cuda.mem_get_info()
+        per_image = _BYTES_PER_IMAGE_720P * (width * height) / (720 * 1280)
+        return max(1, int(free // per_image))
+
+    def generate_many(
+        self,
+        prompts: List[str],
+        out_paths: List[str | Path],
+        *,
+        negative_prompt: str = "",
+        width: int = 720,
+        height: int = 1280,
+        steps: int = 9,
+        guidance: float = 0.0,
+        seed: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        stop: Optional[threading.Event] = None,
+    ) -> List[Path]:
+        """
+        Generates several images, batching prompts into a single denoise where memory allows.
+        Image i uses seed + i, so results match calling generate() per prompt with those seeds.
+        A batch that runs out of CUDA memory is retried at half the size.
+        If stop gets set, no further batch is started and only the paths written so far are returned.
+        """
+        if len(prompts) != len(out_paths):
+            raise ValueError("prompts and out_paths must have the same length.")
+
+        out_paths = [Path(p) for p in out_paths]
+        for p in out_paths:
+            p.parent.mkdir(parents=True, exist_ok=True)
+
+        if batch_size is None:
+            batch_size = self._auto_batch_size(width, height)
+
+        start = 0
+        while start < len(prompts):
+            if stop is not None and stop.is_set():
+                print(f"[image_gen] stopped after {start}/{len(prompts)} images")
+                return out_paths[:start]
+            chunk = prompts[start:start + batch_size]
+            k = len(chunk)
+            seeds = None if seed is None else [seed + start + i for i in range(k)]
+
             try:
-                self.pipe.enable_xformers_memory_efficient_attention()
-            except Exception:
-                pass
+                with torch.inference_mode():
+                    images = self._denoise(
+                        seeds,
+                        prompt=chunk,
+                        negative_prompt=[negative_prompt] * k if negative_prompt else None,
+                        num_inference_steps=steps,
+                        guidance_scale=guidance,
+                        width=width,
+                        height=height,
+                    )
+            except torch.cuda.OutOfMemoryError:
+                if k == 1:
+                    raise
+                images = None
+
+            if images is None:
+                # _auto_batch_size is only an estimate, retry the same images in smaller batches.
+                # Cleaned up outside the except so the traceback no longer pins the failed activations.
+                batch_size = k // 2
+                print(f"[image_gen] out of memory with {k} images per batch, retrying with {batch_size}")
+                gc.collect()
+                torch.cuda.empty_cache()
+                continue
+
+            for image, out_path in zip(images, out_paths[start:start + k]):
+                image.save(out_path)
+            start += k
+
+        return out_paths
 
     def generate(
         self,
@@ -78,25 +233,18 @@ class ImageGenerator:
         guidance: float = 0.0,
         seed: Optional[int] = None,
     ) -> Path:
-        out_path = Path(out_path)
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-
-        generator = None
-        if seed is not None:
-            generator = torch.Generator(device=self.device).manual_seed(seed)
-
-        image = self.pipe(
-            prompt=prompt,
-            negative_prompt=negative_prompt if negative_prompt else None,
-            num_inference_steps=steps,
-            guidance_scale=guidance,
+        return self.generate_many(
+            [prompt],
+            [out_path],
+            negative_prompt=negative_prompt,
             width=width,
             height=height,
-            generator=generator,
-        ).images[0]
+            steps=steps,
+            guidance=guidance,
+            seed=seed,
+            batch_size=1,
+        )[0]
 
-        image.save(out_path)
-        return out_path
 if __name__ == "__main__":
     print("Testing ImageGenerator...")
     gen = ImageGenerator()
@@ -3,14 +3,19 @@ from __future__ import annotations
 import warnings
 warnings.filterwarnings("ignore") # Because I like to live dangerously
 
+import contextlib
 import os
 import re
 import shutil
 import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 
+import soundfile as sf
+import soxr
 import yaml
 import time
 
@@ -18,8 +23,8 @@ from script_gen import generate_script
 from feedback_llm import generate_patch, call_llm
 from prompt_enhance import enhance
 from schemas import merge_video_spec_with_patch
-from image_gen import ImageGenerator
-from audio_gen import CoquiVoiceover, wav_duration_seconds
+# image_gen / CoquiVoiceover load torch, they are imported inside the stages that need them
+from audio_gen import wav_duration_seconds, build_narration_text
 from bgm_gen import generate_bgm
 from subtitles_gen import generate_subtitles_from_mfa_json
 from compositor import compose_final_video
@@ -38,6 +43,7 @@ SD_WIDTH = 720
 SD_HEIGHT = 1280
 SD_STEPS = 9
 SD_GUIDANCE = 0.0
+ENHANCE_WORKERS = 4  # concurrent prompt enhancement requests to ollama
 
 # Video
 OUT_W = 1080
@@ -56,6 +62,14 @@ SUB_OUTLINE = 4
 SUB_SHADOW = 0
 
 SPEAKER = "Viktor Menelaos"  # Coqui TTS speaker name
+
+# Image gen runs in a background thread alongside TTS/MFA/subtitles.
+# Both models default to the same accelerator, this lock keeps only one of them on it at a time
+# (prompt enhancement, MFA and ffmpeg still overlap). Set False if they are on separate devices.
+SERIALIZE_GPU_STAGES = True
+# Free XTTS / Z-Image after their stage so the other model gets the whole card. Only needed when they share one;
+# with False the models stay in the in-process caches (audio_gen._TTS_CACHE, image_gen._PIPE_CACHE) for the next run.
+RELEASE_GPU_MODELS = SERIALIZE_GPU_STAGES
 # =============================================================================
 # PATHS AND FLAGS
 # =============================================================================
@@ -81,6 +95,8 @@ IMAGES_DIR = BUILD / "images"
 SUB_DIR = BUILD / "subtitles"
 MFA_IN = BUILD / "mfa_input"
 MFA_OUT = BUILD / "mfa_output"
+# where MFA keeps downloaded models (MFA_ROOT_DIR overrides its default ~/Documents/MFA)
+MFA_PRETRAINED = Path(os.environ.get("MFA_ROOT_DIR", Path.home() / "Documents" / "MFA")) / "pretrained_models"
 AUDIO_DIR = BUILD / "audio"
 AUDIO_SCENES_DIR = AUDIO_DIR / "scenes"
 
@@ -89,11 +105,31 @@ AUDIO_WAV = BUILD / "audio" / "audio.wav"
 SUB_ASS = BUILD / "subtitles" / "subtitles.ass"
 FINAL_MP4 = BUILD / "final.mp4"
 
+GPU_LOCK = threading.Lock()
+
+# libyaml backed safe loader/dumper when available, same output as safe_load/safe_dump
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# ASCII classes: any non-ASCII whitespace is already turned into a space by _RE_PUNCT
+_RE_PUNCT = re.compile(r"[^a-z0-9\s']", re.ASCII)
+_RE_WS = re.compile(r"\s+", re.ASCII)
+_RE_VERSION = re.compile(r"video_v(\d+)\.yaml$", re.ASCII)
+
 
 # =============================================================================
 # Utils
 # =============================================================================
 
+def gpu_stage():
+    """
+    Context manager guarding model inference on the shared accelerator.
+    """
+    if SERIALIZE_GPU_STAGES:
+        return GPU_LOCK
+    return contextlib.nullcontext()
+
+
 def now_seed(base_seed: int, randomize: bool) -> int:
     if not randomize:
         return int(base_seed)
@@ -101,15 +137,17 @@ def now_seed(base_seed: int, randomize: bool) -> int:
 
 
 def load_yaml(path: Path) -> Dict[str, Any]:
-    return yaml.safe_load(path.read_text(encoding="utf-8"))
+    with open(path, "rb") as f:
+        return yaml.load(f, Loader=YAML_LOADER)
 
 
 def save_yaml(obj: Dict[str, Any], path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     with open(path, "w", encoding="utf-8") as f:
-        yaml.safe_dump(
+        yaml.dump(
             obj,
             f,
+            Dumper=YAML_DUMPER,
             sort_keys=False,
             allow_unicode=True,
             width=100000,
@@ -124,55 +162,37 @@ def normalize_transcript(text: str) -> str:
     - keep apostrophes
     - collapse whitespace
     """
-    text = text.lower()
-    text = re.sub(r"[^a-z0-9\s']", " ", text)
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
-
-
-def build_transcript_from_spec(spec: Dict[str, Any]) -> str:
-    parts = []
-    for s in spec.get("scenes", []):
-        t = (s.get("text") or "").strip()
-        if t:
-            parts.append(t)
-    return " ".join(parts)
+    return _RE_WS.sub(" ", _RE_PUNCT.sub(" ", text.lower())).strip()
 
 
 def ensure_dirs() -> None:
-    BUILD.mkdir(exist_ok=True)
     if not CLEAN_BUILD: print("[pipeline] WARNING: CLEAN_BUILD is False, existing build/ directory will be reused.")
     if CLEAN_BUILD: input("[pipeline] WARNING: This will delete and recreate the build/ directory. Press Enter to continue or Ctrl+C to abort...")
     if CLEAN_BUILD: shutil.rmtree(BUILD, ignore_errors=True)
-    BUILD.mkdir(exist_ok=True)
-    VERSIONS.mkdir(exist_ok=True)
 
-    IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-    SUB_DIR.mkdir(parents=True, exist_ok=True)
-    MFA_IN.mkdir(parents=True, exist_ok=True)
-    MFA_OUT.mkdir(parents=True, exist_ok=True)
+    # parents=True creates BUILD itself on the way
+    for d in (VERSIONS, IMAGES_DIR, SUB_DIR, MFA_IN, MFA_OUT):
+        d.mkdir(parents=True, exist_ok=True)
 
 
 def _next_version_number() -> int:
     """
     versions/video_v1.yaml, video_v2.yaml, ...
     """
-    existing = sorted(VERSIONS.glob("video_v*.yaml"))
-    if not existing:
+    if not VERSIONS.is_dir():
         return 1
-
-    best = 0
-    for p in existing:
-        m = re.match(r"video_v(\d+)\.yaml$", p.name)
-        if m:
-            best = max(best, int(m.group(1)))
-    return best + 1
+    # scandir hands back names directly, no Path object per entry like glob
+    with os.scandir(VERSIONS) as it:
+        return 1 + max(
+            (int(m.group(1)) for e in it if (m := _RE_VERSION.match(e.name))),
+            default=0,
+        )
 
 
-def create_versioned_yaml_from_root() -> Path:
+def create_versioned_yaml_from_root() -> Tuple[Path, Dict[str, Any]]:
     """
     Reads ROOT/video.yaml and writes versions/video_vX.yaml
-    Returns the path to the created version file.
+    Returns the path to the created version file and the parsed spec.
     """
     if not ROOT_VIDEO_YAML.exists():
         raise FileNotFoundError(f"Missing: {ROOT_VIDEO_YAML}")
@@ -183,16 +203,21 @@ def create_versioned_yaml_from_root() -> Path:
     save_yaml(spec, out_path)
 
     print(f"[pipeline] versioned spec created: {out_path}")
-    return out_path
+    return out_path, spec
 
 
-def copy_latest_version_to_build(latest_version_path: Path) -> None:
+def copy_latest_version_to_build(latest_version_path: Path, spec: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
     """
     Copies versions/video_vX.yaml -> build/video.yaml (canonical build spec)
+    spec is the already parsed version file, returned unchanged so callers can skip re-reading it.
     """
     BUILD.mkdir(exist_ok=True)
-    shutil.copy(latest_version_path, BUILD_VIDEO_YAML)
+    # Not a hardlink: build/video.yaml is rewritten in place later (patch merge, durations),
+    # which would silently edit the versioned file too. copyfile uses the OS fast copy path
+    # (sendfile / fcopyfile) and skips the permission copy shutil.copy does.
+    shutil.copyfile(latest_version_path, BUILD_VIDEO_YAML)
     print(f"[pipeline] build spec updated: {BUILD_VIDEO_YAML}")
+    return spec
 
 def start_interactive_chat():
     """
@@ -200,15 +225,19 @@ def start_interactive_chat():
     """
     print("Starting interactive chat session. Type 'exit' to quit.")
     system_prompt = "You are a helpful assistant for generating video scripts and video ideas for short form video content, science explainer style. Do not use any formatting in your responses, just plain text."
+    try:
+        import readline  # noqa: F401  line editing + history for input(), not available on Windows
+    except ImportError:
+        pass
     print("Hi, what do you need help with today? I can give you ideas or anything else if you want.")
     while True:
         user_input = input("User: ")
         if user_input.lower() == 'exit':
             print("Exiting chat session.")
             exit()
-        print("Thinking...")
-        response = call_llm(system_prompt, user_input)
-        print(f"LLM: {response}")
+        # reply is printed token by token as the model generates it
+        print("LLM: ", end="", flush=True)
+        call_llm(system_prompt, user_input, stream=True)
 # =============================================================================
 # Stage A: Generate patch from feedback (optional)
 # =============================================================================
@@ -244,12 +273,14 @@ def run_feedback_llm_if_present(seed: int | None = None, temperature: float | No
 # Stage B: Merge build/video.yaml + build/video_patch.yaml -> build/video.yaml
 # =============================================================================
 
-def merge_patch_into_build_video() -> Dict[str, Any]:
+def merge_patch_into_build_video(spec: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
     Loads build/video.yaml, merges build/video_patch.yaml if present,
     and writes back into build/video.yaml (so build/video.yaml becomes final spec).
+    spec can be passed if build/video.yaml was already parsed, it is only read from disk otherwise.
     """
-    spec = load_yaml(BUILD_VIDEO_YAML)
+    if spec is None:
+        spec = load_yaml(BUILD_VIDEO_YAML)
 
     if BUILD_PATCH_YAML.exists():
         patch = load_yaml(BUILD_PATCH_YAML)
@@ -266,31 +297,56 @@ def merge_patch_into_build_video() -> Dict[str, Any]:
 # Stage 1: Images
 # =============================================================================
 
-def run_images(spec: Dict[str, Any], seed: int, debug: bool = False) -> None:
+def run_images(spec: Dict[str, Any], seed: int, debug: bool = False, stop: Optional[threading.Event] = None) -> None:
+    """
+    stop lets main() cut the image stage short when the narration chain failed,
+    it is checked before loading the model and between image batches.
+    """
     print("[pipeline] generating images...")
 
-    gen = ImageGenerator()
+    scenes = spec["scenes"]
+    out_paths = [IMAGES_DIR / f"{s['id']}.png" for s in scenes]
 
-    for idx, s in enumerate(spec["scenes"]):
-        sid = s["id"]
+    def enhance_scene(idx: int) -> str:
+        s = scenes[idx]
         prompt = s["visual"]["prompt"]
-        out_path = IMAGES_DIR / f"{sid}.png"
-
         # Derive per-scene seed so each scene is stable but different
         scene_seed = seed + idx
         enhanced_prompt = enhance(prompt, seed=scene_seed, style="artstation", debug=debug)
-        if debug : print(f"[pipeline] scene {sid}: seed={scene_seed}, prompt='{prompt}, revised_prompt='{enhanced_prompt}'")
-        print(f"[pipeline] generating image for scene {sid}...")
-        gen.generate(
-            prompt=enhanced_prompt,
-            out_path=out_path,
-            width=SD_WIDTH,
-            height=SD_HEIGHT,
-            steps=SD_STEPS,
-            guidance=SD_GUIDANCE,
-            seed=scene_seed,  # if you want randomness -> set seed=None
-        )
-
+        if debug : print(f"[pipeline] scene {s['id']}: seed={scene_seed}, prompt='{prompt}, revised_prompt='{enhanced_prompt}'")
+        return enhanced_prompt
+
+    # Prompt enhancement is just ollama requests, run them concurrently (results keep scene order)
+    with ThreadPoolExecutor(max_workers=max(1, min(ENHANCE_WORKERS, len(scenes)))) as ex:
+        prompts = list(ex.map(enhance_scene, range(len(scenes))))
+
+    from image_gen import ImageGenerator
+
+    with gpu_stage():
+        if stop is not None and stop.is_set():
+            print("[pipeline] image generation stopped")
+            return
+        gen = ImageGenerator()
+
+        print(f"[pipeline] generating {len(prompts)} scene images...")
+        # image idx gets seed + idx, same per-scene seed as the prompt enhancement
+        try:
+            gen.generate_many(
+                prompts=prompts,
+                out_paths=out_paths,
+                width=SD_WIDTH,
+                height=SD_HEIGHT,
+                steps=SD_STEPS,
+                guidance=SD_GUIDANCE,
+                seed=seed,  # if you want randomness -> set seed=None
+                stop=stop,
+            )
+        finally:
+            # TTS runs alongside this stage, don't keep the diffusion model resident on a shared GPU
+            if RELEASE_GPU_MODELS:
+                gen.release()
+
+    for out_path in out_paths:
         print(f"[pipeline] image done: {out_path}")
 
 
@@ -317,47 +373,61 @@ def pick_tts_device() -> str:
 def run_tts(spec: Dict[str, Any]) -> None:
     print("[pipeline] generating voiceover...")
 
+    from audio_gen import CoquiVoiceover
+
     vo = CoquiVoiceover()
-    vo.generate(
-        spec=spec,
-        out_wav_path=AUDIO_WAV,
-    )
+    try:
+        vo.generate(
+            spec=spec,
+            out_wav_path=AUDIO_WAV,
+        )
+    finally:
+        if RELEASE_GPU_MODELS:
+            vo.release()
 
     print("[pipeline] voiceover saved:", AUDIO_WAV)
 
 def run_tts_per_scene(spec):
     AUDIO_SCENES_DIR.mkdir(parents=True, exist_ok=True)
 
-    vo = CoquiVoiceover(model_name="tts_models/multilingual/multi-dataset/xtts_v2", device=pick_tts_device())
-
-    durations = {}
-
-    for scene in spec["scenes"]:
-        sid = scene["id"]
-        text = scene["text"]
-        out_wav = AUDIO_SCENES_DIR / f"{sid}.wav"
-
-        vo.generate_one(text=text, out_wav_path=out_wav, speaker=SPEAKER)
-        durations[sid] = wav_duration_seconds(str(out_wav))
-
-    return durations
+    scene_ids = [scene["id"] for scene in spec["scenes"]]
+    out_wavs = [AUDIO_SCENES_DIR / f"{sid}.wav" for sid in scene_ids]
+
+    from audio_gen import CoquiVoiceover
+
+    with gpu_stage():
+        vo = CoquiVoiceover(model_name="tts_models/multilingual/multi-dataset/xtts_v2", device=pick_tts_device())
+        sample_rate = vo.sample_rate
+        try:
+            wavs = vo.generate_many(
+                texts=[scene["text"] for scene in spec["scenes"]],
+                out_wav_paths=out_wavs,
+                speaker=SPEAKER,
+            )
+        finally:
+            # image generation runs alongside this stage, don't keep XTTS resident on a shared GPU
+            if RELEASE_GPU_MODELS:
+                vo.release()
+
+    # Durations straight from the in-memory waveforms, no need to reopen the files.
+    # They include the silence XTTS leaves after every sentence, same as reading the wav headers did.
+    return {sid: len(wav) / sample_rate for sid, wav in zip(scene_ids, wavs)}
 
 def concat_audio_wavs(scene_ids):
-    list_file = AUDIO_SCENES_DIR / "audio_list.txt"
-    # list_file = Path("audio_list.txt")
-    lines = []
-    for sid in scene_ids:
-        lines.append(f"file '{Path(f'{sid}.wav').as_posix()}'")
-
-    list_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
-
-    subprocess.run([
-        "ffmpeg","-y",
-        "-f","concat","-safe","0",
-        "-i", str(list_file),
-        "-c","copy",
-        str(AUDIO_WAV)
-    ], check=True)
+    """
+    Appends the per-scene wavs into AUDIO_WAV with libsndfile, no ffmpeg process.
+    All scenes come from the same TTS model so rate/channels/subtype match.
+    """
+    scene_wavs = [AUDIO_SCENES_DIR / f"{sid}.wav" for sid in scene_ids]
+    info = sf.info(str(scene_wavs[0]))
+
+    AUDIO_WAV.parent.mkdir(parents=True, exist_ok=True)
+    with sf.SoundFile(str(AUDIO_WAV), "w", samplerate=info.samplerate, channels=info.channels, subtype=info.subtype) as out:
+        for wav in scene_wavs:
+            data, sr = sf.read(str(wav), dtype="float32", always_2d=True)
+            if sr != info.samplerate or data.shape[1] != info.channels:
+                raise ValueError(f"Scene audio format mismatch: {wav}")
+            out.write(data)
 
 def run_bgm(spec: Dict[str, Any], bgm_output: Path = BGM_OUTPUT, seed: int|None = None, temperature: float|None = None) -> None:
     print("[pipeline] generating background music...")
@@ -376,36 +446,35 @@ def run_bgm(spec: Dict[str, Any], bgm_output: Path = BGM_OUTPUT, seed: int|None
 # Stage 3: MFA prep + align
 # =============================================================================
 
-def prepare_mfa_input(spec: Dict[str, Any]) -> None:
+def prepare_mfa_input(spec: Dict[str, Any], narration: Optional[str] = None) -> None:
     print("[pipeline] preparing MFA input...")
 
     MFA_IN.mkdir(parents=True, exist_ok=True)
 
     # Transcript
-    transcript = normalize_transcript(build_transcript_from_spec(spec))
+    if narration is None:
+        narration = build_narration_text(spec)
+    transcript = normalize_transcript(narration)
     (MFA_IN / "audio.txt").write_text(transcript + "\n", encoding="utf-8")
     print("[pipeline] MFA transcript:", transcript)
 
-    # Resample audio to 16k mono PCM s16le
+    # Resample audio to 16k mono PCM s16le (in process, soxr instead of an ffmpeg call)
     out_audio = MFA_IN / "audio.wav"
-    cmd = [
-        "ffmpeg", "-y",
-        "-i", str(AUDIO_WAV),
-        "-ac", "1",
-        "-ar", "16000",
-        "-c:a", "pcm_s16le",
-        str(out_audio),
-    ]
-    subprocess.run(cmd, check=True)
+    data, sr = sf.read(str(AUDIO_WAV), dtype="float32", always_2d=True)
+    mono = data.mean(axis=1)
+    if sr != 16000:
+        mono = soxr.resample(mono, sr, 16000)
+    sf.write(str(out_audio), mono, 16000, subtype="PCM_16")
     print("[pipeline] MFA audio:", out_audio)
 
 
 def run_mfa_align() -> Path:
     print("[pipeline] running MFA align...")
 
-    # Make sure models exist
-    subprocess.run(["mfa", "model", "download", "dictionary", "english_us_arpa"], check=True)
-    subprocess.run(["mfa", "model", "download", "acoustic", "english_us_arpa"], check=True)
+    # Make sure models exist, each download is a full MFA startup so skip it when already cached
+    for kind, fname in (("dictionary", "english_us_arpa.dict"), ("acoustic", "english_us_arpa.zip")):
+        if not (MFA_PRETRAINED / kind / fname).exists():
+            subprocess.run(["mfa", "model", "download", kind, "english_us_arpa"], check=True)
 
     # Fresh output
     if MFA_OUT.exists():
@@ -422,6 +491,7 @@ def run_mfa_align() -> Path:
         "--clean",
         "--output_format", "json",
         "--single_speaker",
+        "-j", str(os.cpu_count() or 1),
     ]
     subprocess.run(cmd, check=True)
 
@@ -507,49 +577,64 @@ def main():
     
 
     # 0) Versioning: create versions/video_vX.yaml from ROOT/video.yaml
-    latest_version = create_versioned_yaml_from_root()
+    latest_version, spec = create_versioned_yaml_from_root()
 
     # 1) Copy latest version into build/video.yaml
-    copy_latest_version_to_build(latest_version)
+    spec = copy_latest_version_to_build(latest_version, spec)
 
     # 2) Generate patch from feedback (optional)
     run_feedback_llm_if_present(seed=seed, temperature=1.0)
 
     # 3) Merge patch into build/video.yaml (final spec lives in build/video.yaml)
-    spec = merge_patch_into_build_video()
+    spec = merge_patch_into_build_video(spec)
 
 
     
     print(f"[pipeline] seed = {seed} (BASE_SEED={BASE_SEED}, RANDOMIZE_SEED={RANDOMIZE_SEED})")
 
+    # Scene texts are final after the merge, build the joined narration once
+    narration = build_narration_text(spec)
+
     
 
-    # # 5) Generate audio
-    durations = run_tts_per_scene(spec)
+    stop_images = threading.Event()
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        # 4) Generate images in the background, they only depend on the spec prompts
+        fut_img = ex.submit(run_images, spec, seed, stop=stop_images)
+        try:
+            # # 5) Generate audio
+            durations = run_tts_per_scene(spec)
 
-    # overwrite YAML durations
-    for s in spec["scenes"]:
-        s["duration"] = round(durations[s["id"]] + 0.45, 2)  # compensating for crossfade
-    
-    #Overwrite durations in build/video.yaml
-    save_yaml(spec, BUILD_VIDEO_YAML)
+            # overwrite YAML durations, collecting scene ids in the same pass
+            scene_ids = []
+            for s in spec["scenes"]:
+                s["duration"] = round(durations[s["id"]] + 0.45, 2)  # compensating for crossfade
+                scene_ids.append(s["id"])
+
+            #Overwrite durations in build/video.yaml
+            save_yaml(spec, BUILD_VIDEO_YAML)
+
+            concat_audio_wavs(scene_ids)
 
-    scene_ids = [s["id"] for s in spec["scenes"]]
-    concat_audio_wavs(scene_ids)
+            # save_yaml(spec, Path(ROOT/"test.yaml"))  # save updated durations
 
-    # save_yaml(spec, Path(ROOT/"test.yaml"))  # save updated durations
+            # 7) Generate BGM (optional), needs the narration length, runs in its own env so overlaps MFA/images
+            fut_bgm = ex.submit(run_bgm, spec, bgm_output=BGM_OUTPUT, seed=seed, temperature=1.0) if BGM_ENABLED else None
 
-    # 6) MFA alignment JSON
-    prepare_mfa_input(spec)
-    mfa_json = run_mfa_align()
+            # 6) MFA alignment JSON
+            prepare_mfa_input(spec, narration=narration)
+            mfa_json = run_mfa_align()
 
-    # 7) Karaoke subtitles
-    run_subtitles(mfa_json)
+            # 7) Karaoke subtitles
+            run_subtitles(mfa_json)
 
-    # 4) Generate images
-    run_images(spec, seed=seed)
-    # 7) Generate BGM (optional)
-    if BGM_ENABLED: run_bgm(spec, bgm_output=BGM_OUTPUT, seed=seed, temperature=1.0)
+            for fut in (fut_img, fut_bgm):
+                if fut is not None:
+                    fut.result()
+        except BaseException:
+            # leaving the with block waits for the worker, don't let it finish the whole image batch first
+            stop_images.set()
+            raise
 
     # 8) Compose final video
     run_compositor(spec)
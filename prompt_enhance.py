@@ -1,12 +1,19 @@
 # prompt_enhance.py
 from __future__ import annotations
 
+import hashlib
 import json
+import os
+from pathlib import Path
 from typing import Optional
 
 
 LLM_MODEL = "llama3.1:8b"  # or local model name
 
+# enhance() results, one file per input hash. Delete the dir to invalidate.
+# Kept outside build/ so it survives CLEAN_BUILD, which is exactly the re-run case it is for.
+ENHANCE_CACHE_DIR = Path(".cache") / "enhance"
+
 
 SYSTEM_PROMPT = """You are a visual specification engine for Stable Diffusion.
 
@@ -82,6 +89,31 @@ def call_llm(system_prompt: str, user_prompt: str, *, seed: int | None = None, t
     return response['message']['content']
 
 
+# ---------- DISK CACHE ----------
+def _cache_path(system_prompt: str, user_prompt: str, temperature: float, seed: int) -> Path:
+    """
+    Keyed on everything sent to the model (rendered messages + model + options),
+    so editing SYSTEM_PROMPT or the user template invalidates old entries.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in (LLM_MODEL, str(temperature), str(seed), system_prompt, user_prompt):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")  # separator, so fields can't run into each other
+    return ENHANCE_CACHE_DIR / f"{h.hexdigest()}.txt"
+
+
+def _cache_put(path: Path, text: str) -> None:
+    """
+    Atomic write (tmp file + os.replace), a crashed run never leaves a half written entry.
+    """
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError:
+        pass  # caching is best effort
+
 
 def enhance(
     prompt: str,
@@ -99,6 +131,7 @@ def enhance(
 
     Returns a single-line enhanced prompt string.
     Falls back to original prompt on failure.
+    With a seed the output is deterministic, so it is cached on disk under ENHANCE_CACHE_DIR.
     """
     prompt = (prompt or "").strip()
     if not prompt:
@@ -119,6 +152,11 @@ Return a significantly more detailed Stable Diffusion prompt.
 You MUST add: camera framing, lens look, lighting direction, color palette, and composition depth.
 Return ONE line under 55 words.
 """.strip()
+
+    cache_path = _cache_path(SYSTEM_PROMPT, user_prompt, temperature, seed) if seed is not None else None
+    if cache_path is not None and cache_path.is_file():
+        return cache_path.read_text(encoding="utf-8")
+
     try:
         out = call_llm(
             system_prompt=SYSTEM_PROMPT,
@@ -134,15 +172,17 @@ Return ONE line under 55 words.
         if not out or len(out) < 8:
             return prompt
 
-
-        return out
-
     except Exception as e:
         print("⚠️ prompt enhancement failed, using original prompt")
         if debug:
             print(f"Error: {e}")
         # fallback: just use original
         return prompt
+
+    if cache_path is not None:
+        _cache_put(cache_path, out)
+    return out
+
 if __name__ == "__main__":
     print("Testing prompt enhancement...")
     prompt = "A vast view of outer space with swirling galaxies and glowing nebulae, stars scattered across deep darkness, subtle light flares illuminating cosmic dust, dramatic lighting emphasizing scale and mystery, no text or symbols, cinematic"
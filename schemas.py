@@ -1,11 +1,13 @@
 # schemas.py
 from __future__ import annotations
 
+import sys
 from copy import deepcopy
-from typing import Any, Dict, Tuple
+from typing import Any, Callable, Dict, Iterator, Tuple
 
 
-ALLOWED_MOTIONS = {"slow_zoom", "pan_left", "pan_right", "static"}
+ALLOWED_MOTIONS = frozenset(map(sys.intern, ("slow_zoom", "pan_left", "pan_right", "static")))
+_ALLOWED_MOTIONS_SORTED = sorted(ALLOWED_MOTIONS)  # for error messages
 
 
 class PatchError(Exception):
@@ -16,6 +18,78 @@ def _is_number(x: Any) -> bool:
     return isinstance(x, (int, float)) and not isinstance(x, bool)
 
 
+def _is_str(x: Any) -> bool:
+    return isinstance(x, str)
+
+
+def _is_dict(x: Any) -> bool:
+    return isinstance(x, dict)
+
+
+def _intern_id(x: Any) -> Any:
+    return sys.intern(x) if type(x) is str else x
+
+
+def _report(msg: str, strict: bool, summary: Dict[str, Any], bucket: str = "errors") -> None:
+    """
+    Raises in strict mode, otherwise records msg in summary[bucket].
+    """
+    if strict:
+        raise PatchError(msg)
+    summary[bucket].append(msg)
+
+
+def _take_field(
+    edits: Dict[str, Any],
+    key: str,
+    is_valid: Callable[[Any], bool],
+    bad_msg: Callable[[Any], str],
+    scene_id: str,
+    *,
+    strict: bool,
+    summary: Dict[str, Any],
+) -> Tuple[bool, Any]:
+    """
+    Reads one patch field. Returns (True, value) if present and valid.
+    null values are logged as ignored, invalid ones go through _report; both return (False, None).
+    """
+    if key not in edits:
+        return False, None
+    val = edits[key]
+    if val is None:
+        summary["ignored"].append(f"Ignored {key}=null for {scene_id}")
+        return False, None
+    if not is_valid(val):
+        _report(bad_msg(val), strict, summary)
+        return False, None
+    return True, val
+
+
+def _validate_patch_shape(
+    patch: Dict[str, Any],
+    scene_index: Dict[Any, int],
+    strict: bool,
+    summary: Dict[str, Any],
+) -> Iterator[Tuple[Any, int, Dict[str, Any]]]:
+    """
+    Yields (scene_id, scene list index, edits dict) for every patch entry that targets a known scene.
+    Unknown ids and non-dict edits go through _report into summary["ignored"].
+    Lazy on purpose, so strict mode raises on the same entry as a single pass would.
+    """
+    for scene_id, edits in patch["scenes"].items():
+        scene_id = _intern_id(scene_id)
+        idx = scene_index.get(scene_id)
+        if idx is None:
+            _report(f"Unknown scene_id '{scene_id}' in patch.", strict, summary, "ignored")
+            continue
+
+        if not isinstance(edits, dict):
+            _report(f"Edits for scene '{scene_id}' must be a dict.", strict, summary, "ignored")
+            continue
+
+        yield scene_id, idx, edits
+
+
 def merge_video_spec_with_patch(
     spec: Dict[str, Any],
     patch: Dict[str, Any],
@@ -50,159 +124,125 @@ def merge_video_spec_with_patch(
 
     strict=True will raise on unknown scene IDs or invalid schema.
     strict=False will ignore unknown scenes/fields.
+
+    The input spec is never mutated. Only scenes named in the patch are deep-copied,
+    all other scene dicts are shared between spec and new_spec.
     """
 
-    new_spec = deepcopy(spec)
+    new_spec = dict(spec)
+    if isinstance(spec.get("scenes"), list):
+        new_spec["scenes"] = list(spec["scenes"])
     summary = {
         "changed_scenes": [],
         "ignored": [],
         "errors": [],
     }
 
-    if not patch or patch == {"scenes": {}}:
+    # Nothing to do for an empty patch / "scenes: {}" (the LLM's no-change answer)
+    if not patch or (
+        isinstance(patch, dict)
+        and len(patch) == 1
+        and isinstance(patch.get("scenes"), dict)
+        and not patch["scenes"]
+    ):
         return new_spec, summary
-    
+
     if "scenes" not in patch:
-        
-        msg = "Patch missing top-level key 'scenes'."
-        if strict:
-            raise PatchError(msg)
-        summary["ignored"].append(msg)
+        _report("Patch missing top-level key 'scenes'.", strict, summary, "ignored")
         return new_spec, summary
 
     if not isinstance(patch["scenes"], dict):
-        msg = "Patch 'scenes' must be a mapping/dict of scene_id -> edits."
-        if strict:
-            raise PatchError(msg)
-        summary["ignored"].append(msg)
+        _report("Patch 'scenes' must be a mapping/dict of scene_id -> edits.", strict, summary, "ignored")
         return new_spec, summary
 
     # Build scene lookup
     if "scenes" not in new_spec or not isinstance(new_spec["scenes"], list):
         raise PatchError("Spec must contain 'scenes' as a list.")
 
-    scene_index = {s.get("id"): i for i, s in enumerate(new_spec["scenes"]) if isinstance(s, dict)}
-    valid_scene_ids = set(scene_index.keys())
+    # string ids are interned so lookups from interned patch keys hit on identity
+    scene_index = {_intern_id(s.get("id")): i for i, s in enumerate(new_spec["scenes"]) if isinstance(s, dict)}
 
-    for scene_id, edits in patch["scenes"].items():
-        if scene_id not in valid_scene_ids:
-            msg = f"Unknown scene_id '{scene_id}' in patch."
-            if strict:
-                raise PatchError(msg)
-            summary["ignored"].append(msg)
-            continue
-
-        if not isinstance(edits, dict):
-            msg = f"Edits for scene '{scene_id}' must be a dict."
-            if strict:
-                raise PatchError(msg)
-            summary["ignored"].append(msg)
-            continue
-
-        s = new_spec["scenes"][scene_index[scene_id]]
+    for scene_id, idx, edits in _validate_patch_shape(patch, scene_index, strict, summary):
+        # copy-on-write: only the patched scene gets its own copy
+        s = deepcopy(new_spec["scenes"][idx])
+        new_spec["scenes"][idx] = s
         changed_anything = False
 
         # ---- duration delta ----
-        if "duration" in edits:
-            delta = edits["duration"]
-            if delta is None:
-                summary["ignored"].append(f"Ignored duration=null for {scene_id}")
-            elif not _is_number(delta):
-                msg = f"Scene '{scene_id}': duration must be a number delta (+/-). Got: {delta!r}"
-                if strict:
-                    raise PatchError(msg)
-                summary["errors"].append(msg)
+        ok, delta = _take_field(
+            edits, "duration", _is_number,
+            lambda v: f"Scene '{scene_id}': duration must be a number delta (+/-). Got: {v!r}",
+            scene_id, strict=strict, summary=summary,
+        )
+        if ok:
+            new = float(s.get("duration", 0.0)) + float(delta)
+            if new <= 0:
+                _report(f"Scene '{scene_id}': duration became <= 0 after patch ({new}).", strict, summary)
             else:
-                old = float(s.get("duration", 0.0))
-                new = old + float(delta)
-                if new <= 0:
-                    msg = f"Scene '{scene_id}': duration became <= 0 after patch ({new})."
-                    if strict:
-                        raise PatchError(msg)
-                    summary["errors"].append(msg)
-                else:
-                    s["duration"] = round(new, 3)
-                    changed_anything = True
+                s["duration"] = round(new, 3)
+                changed_anything = True
 
         # ---- text replacement ----
-        if "text" in edits:
-            new_text = edits["text"]
-            if new_text is None:
-                summary["ignored"].append(f"Ignored text=null for {scene_id}")
-            elif not isinstance(new_text, str):
-                msg = f"Scene '{scene_id}': text must be a string. Got: {type(new_text).__name__}"
-                if strict:
-                    raise PatchError(msg)
-                summary["errors"].append(msg)
-            else:
-                # Full replacement (not "adjustment")
-                s["text"] = new_text.strip()
-                changed_anything = True
+        ok, new_text = _take_field(
+            edits, "text", _is_str,
+            lambda v: f"Scene '{scene_id}': text must be a string. Got: {type(v).__name__}",
+            scene_id, strict=strict, summary=summary,
+        )
+        if ok:
+            # Full replacement (not "adjustment")
+            s["text"] = new_text.strip()
+            changed_anything = True
 
         # ---- visual edits ----
-        if "visual" in edits:
-            v_edits = edits["visual"]
-            if v_edits is None:
-                summary["ignored"].append(f"Ignored visual=null for {scene_id}")
-            elif not isinstance(v_edits, dict):
-                msg = f"Scene '{scene_id}': visual must be a dict."
-                if strict:
-                    raise PatchError(msg)
-                summary["errors"].append(msg)
-            else:
-                if "visual" not in s or not isinstance(s["visual"], dict):
-                    s["visual"] = {}
-
-                # prompt_adjustment -> append to prompt
-                if "prompt_adjustment" in v_edits:
-                    adj = v_edits["prompt_adjustment"]
-                    if adj is None:
-                        summary["ignored"].append(f"Ignored prompt_adjustment=null for {scene_id}")
-                    elif not isinstance(adj, str):
-                        msg = f"Scene '{scene_id}': prompt_adjustment must be a string."
-                        if strict:
-                            raise PatchError(msg)
-                        summary["errors"].append(msg)
-                    else:
-                        base_prompt = s["visual"].get("prompt", "").strip()
-                        adj_clean = adj.strip()
-
-                        if base_prompt and adj_clean:
-                            s["visual"]["prompt"] = f"{base_prompt}, {adj_clean}"
-                        elif adj_clean:
-                            s["visual"]["prompt"] = adj_clean
-                        changed_anything = True
-
-                # motion -> replace if valid (ignore null)
-                if "motion" in v_edits:
-                    motion = v_edits["motion"]
-                    if motion is None:
-                        summary["ignored"].append(f"Ignored motion=null for {scene_id}")
-                    elif not isinstance(motion, str):
-                        msg = f"Scene '{scene_id}': motion must be a string."
-                        if strict:
-                            raise PatchError(msg)
-                        summary["errors"].append(msg)
-                    else:
-                        motion_clean = motion.strip()
-                        if motion_clean not in ALLOWED_MOTIONS:
-                            msg = (
-                                f"Scene '{scene_id}': motion '{motion_clean}' invalid. "
-                                f"Allowed: {sorted(ALLOWED_MOTIONS)}"
-                            )
-                            if strict:
-                                raise PatchError(msg)
-                            summary["errors"].append(msg)
-                        else:
-                            s["visual"]["motion"] = motion_clean
-                            changed_anything = True
-
-                # disallow full prompt replacement via "prompt"
-                if "prompt" in v_edits:
-                    msg = f"Scene '{scene_id}': patch attempted to set 'visual.prompt'. Use prompt_adjustment only."
-                    if strict:
-                        raise PatchError(msg)
-                    summary["ignored"].append(msg)
+        ok, v_edits = _take_field(
+            edits, "visual", _is_dict,
+            lambda v: f"Scene '{scene_id}': visual must be a dict.",
+            scene_id, strict=strict, summary=summary,
+        )
+        if ok:
+            if "visual" not in s or not isinstance(s["visual"], dict):
+                s["visual"] = {}
+
+            # prompt_adjustment -> append to prompt
+            ok, adj = _take_field(
+                v_edits, "prompt_adjustment", _is_str,
+                lambda v: f"Scene '{scene_id}': prompt_adjustment must be a string.",
+                scene_id, strict=strict, summary=summary,
+            )
+            if ok:
+                base_prompt = s["visual"].get("prompt", "").strip()
+                adj_clean = adj.strip()
+
+                if base_prompt and adj_clean:
+                    s["visual"]["prompt"] = f"{base_prompt}, {adj_clean}"
+                elif adj_clean:
+                    s["visual"]["prompt"] = adj_clean
+                changed_anything = True
+
+            # motion -> replace if valid (ignore null)
+            ok, motion = _take_field(
+                v_edits, "motion", _is_str,
+                lambda v: f"Scene '{scene_id}': motion must be a string.",
+                scene_id, strict=strict, summary=summary,
+            )
+            if ok:
+                motion_clean = sys.intern(motion.strip())
+                if motion_clean not in ALLOWED_MOTIONS:
+                    _report(
+                        f"Scene '{scene_id}': motion '{motion_clean}' invalid. "
+                        f"Allowed: {_ALLOWED_MOTIONS_SORTED}",
+                        strict, summary,
+                    )
+                else:
+                    s["visual"]["motion"] = motion_clean
+                    changed_anything = True
+
+            # disallow full prompt replacement via "prompt"
+            if "prompt" in v_edits:
+                _report(
+                    f"Scene '{scene_id}': patch attempted to set 'visual.prompt'. Use prompt_adjustment only.",
+                    strict, summary, "ignored",
+                )
 
         if changed_anything:
             summary["changed_scenes"].append(scene_id)
@@ -210,14 +250,17 @@ def merge_video_spec_with_patch(
     return new_spec, summary
 if __name__ == "__main__":
     import yaml
-    with open("video.yaml", "r", encoding="utf-8") as f:
-        spec = yaml.safe_load(f)
-    with open("build/video_patch.yaml", "r", encoding="utf-8") as f:
-        patch = yaml.safe_load(f)
+    Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    with open("video.yaml", "rb") as f:
+        spec = yaml.load(f, Loader=Loader)
+    with open("build/video_patch.yaml", "rb") as f:
+        patch = yaml.load(f, Loader=Loader)
 
 
     new_spec, summary = merge_video_spec_with_patch(spec, patch, strict=True)
-    yaml.safe_dump(new_spec, open("build/video_test.yaml", "w"), sort_keys=False, allow_unicode=True, width=100000)
+    with open("build/video_test.yaml", "w", encoding="utf-8") as f:
+        yaml.dump(new_spec, f, Dumper=Dumper, sort_keys=False, allow_unicode=True, width=100000)
 
     print("Summary:")
     print(summary)
\ No newline at end of file
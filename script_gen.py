@@ -1,116 +1,30 @@
-import yaml
+import os
+import re
+from functools import lru_cache
 from pathlib import Path
+from typing import List
 
 # ---------- CONFIG ----------
 LLM_MODEL = "llama3.1:8b"  # or local model name
+# How long ollama keeps the model (and the KV cache of the last prompt) loaded after a call, eg: "30m".
+# Unset uses ollama's default (5m), a longer value would keep it in VRAM next to Z-Image and XTTS.
+LLM_KEEP_ALIVE = os.environ.get("SPARKY_LLM_KEEP_ALIVE") or None
 
-def call_llm(system_prompt: str, user_prompt: str, *, seed: int | None = None, temperature: float | None = None) -> str:
-    from ollama import chat
-    from ollama import ChatResponse
-    options = {}
-    if seed is not None:
-        options["seed"] = int(seed)
-    if temperature is not None:
-        options["temperature"] = float(temperature)
-    response: ChatResponse = chat(model=LLM_MODEL, messages=[
-        {
-            'role': 'system',
-            'content': system_prompt,
-        },
-        {
-            'role': 'user',
-            'content': user_prompt,
-        },
-
-    ], options=options if options else None)
-    return response['message']['content'].strip().encode('ascii','ignore').decode('ascii', errors='ignore')
-
-def generate_script(input_fpath:Path, output_yaml_path:Path, *, seed: int | None = None, temperature: float | None = None):
-    input_prompt = input_fpath.read_text()
-    if input_prompt.strip() == "":
-        raise ValueError("Input prompt file is empty.")
-#     system_prompt = """
-# You are a Video YAML Generator assistant. Your ONLY job is to output a single YAML file called video.yaml as plain text.
-
-# ABSOLUTE OUTPUT RULES (HIGHEST PRIORITY)
-
-# * Output ONLY valid YAML. No markdown. No extra text.
-# * Output ONLY the YAML content starting exactly with the line: global:
-# * Do NOT output anything before or after the YAML (no preface, no explanations, no commentary, no labels).
-# * Do NOT output 'Generated YAML:', 'Here is the YAML:', Markdown fences, or any non-YAML text.
-# * Do NOT wrap the YAML in ``` or any code block markers.
-# * Output must be directly parseable by PyYAML with zero modifications.
 
-# FORMAT + SCHEMA (MUST MATCH EXACTLY)
+@lru_cache(maxsize=None)
+def _yaml_loader_dumper() -> tuple:
+    """
+    libyaml backed (Loader, Dumper) when PyYAML was built with it, pure python otherwise.
+    yaml is imported on first use, importing this module stays cheap.
+    """
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    if loader is yaml.SafeLoader:
+        print("[script_gen] WARNING: libyaml not available, using the slower pure python YAML loader")
+    return loader, dumper
 
-# * The YAML must contain ONLY these keys and structure (no extra keys anywhere):
-#   global:
-#   aspect_ratio: '9:16'
-#   title: '<short, catchy video title>'
-#   description: '<brief video description, 1-2 sentences>'
-#   scenes:
-
-#   * id: 's1'
-#     duration: <float>
-#     text: '<narration line, single line>'
-#     visual:
-#     type: 'image'
-#     prompt: '<stable diffusion prompt, single line>'
-#     motion: '<slow_zoom|pan_left|pan_right|static>'
-
-# * Do NOT add any extra fields such as: voice, music, sfx, transitions, tags, hashtags, style, camera, negative_prompt, notes, metadata, or anything else.
-
-# * Use correct indentation: 2 spaces only.
-
-# * Scenes must be a YAML list under scenes: exactly as shown.
-
-# STRING RULES (VERY STRICT)
-
-# * Use single quotes for ALL YAML string values (including title, description, text, type, prompt, motion, ids).
-# * Never use double quotes (") anywhere.
-# * If any string contains a single quote (') escape it ONLY by doubling it ('') and NEVER by using backslashes.
-# * The narration text for each scene MUST be a single line (no newline characters).
-# * The visual prompt MUST be a single line (no newline characters).
-
-# VIDEO CONTENT RULES
-
-# * Narration must be a single monologue. No dialogue, no multiple speakers, no quotes as conversation.
-# * The opening scene must hook immediately with a strong question, bold claim, or surprising fact related to the topic.
-# * Style: clear, confident, short-form explainer tone.
-# * Total duration MUST be 75.0 seconds unless the user specifies otherwise.
-# * Each scene duration MUST be less than 7.0 seconds.
-# * Scene durations MUST vary slightly (roughly 3.0 to 6.9 seconds) to create rhythm.
-# * The sum of all scene durations MUST equal exactly 75.0 seconds.
-
-# VISUAL PROMPT RULES (NO ABSTRACT PROMPTS)
-
-# * Each prompt MUST be strictly concrete and physically visualizable.
-# * Prompts MUST describe tangible scenes only: real objects, people, environments, actions.
-# * Prompts MUST include: setting + lighting + main subject + tone, all in one single line.
-# * Prompts MUST be creative and visually compelling.
-# * Prompts MUST explicitly ensure: no text, no captions, no words, no letters, no UI, no subtitles, no split screens.
-# * Prompts MUST NOT mention any of these words or ideas: 'split-screen', 'diagram', 'text overlay', 'captions', 'words', 'letters', 'UI', 'subtitles'.
-
-# MOTION RULES
-
-# * Use mostly 'slow_zoom'.
-# * Use occasional 'pan_left' or 'pan_right'.
-# * Use 'static' rarely.
-
-# BEHAVIOR RULES
-
-# * If the user provides a video idea, immediately output the YAML only.
-# * If the user input is very short (under 10 words), expand it into a complete 75-second explainer video while staying on-topic.
-# * Never ask clarifying questions. Always make a best effort and generate the full YAML.
-
-# FAIL-SAFE
-
-# * If you are about to output anything other than valid YAML starting with 'global:', STOP and output ONLY the YAML.
-
-# Now wait for the user idea and respond with ONLY the YAML.
-
-#     """
-    system_prompt = """You are a Video YAML Generator assistant. The Video YAML Generator converts user video ideas into strictly formatted YAML files called video.yaml for an automated video generation pipeline. The YAML output contains metadata and scene details used to generate narration, visuals, and final short-form videos. The assistant must output ONLY valid YAML (no explanations) following this schema:
+SYSTEM_PROMPT = """You are a Video YAML Generator assistant. The Video YAML Generator converts user video ideas into strictly formatted YAML files called video.yaml for an automated video generation pipeline. The YAML output contains metadata and scene details used to generate narration, visuals, and final short-form videos. The assistant must output ONLY valid YAML (no explanations) following this schema:
 global:
   aspect_ratio: '9:16'
   title: '<short, catchy video title>'
@@ -148,28 +62,199 @@ Rules:
 
 The assistant must follow these rules strictly and not output anything other than directly parseable plain valid YAML code as text
 """
-    user_prompt = f"""
+
+# LLM output that already starts at the top-level key is written as-is, no re-dump needed
+_RE_GLOBAL_START = re.compile(r"global:[ \t]*\r?\n")
+
+USER_TEMPLATE = """
 Generate a video.yaml file based on the following user video idea or concept:
 {input_prompt}
 
 Also add a call to action (a call to comment or like or subscribe) at the end of the narration text. The call to action should be brief and natural and relate to the video topic, and encourage viewers to engage with the content.
 """
-    output_yaml = call_llm(system_prompt, user_prompt, seed=seed, temperature=temperature)
-    # Check if yaml is valid
+
+def _llm_messages(system_prompt: str, user_prompt: str) -> list:
+    return [
+        {
+            'role': 'system',
+            'content': system_prompt,
+        },
+        {
+            'role': 'user',
+            'content': user_prompt,
+        },
+    ]
+
+
+@lru_cache(maxsize=32)
+def _llm_options(seed: int | None, temperature: float | None) -> dict | None:
+    """
+    The same dict is returned for repeated (seed, temperature), callers must not mutate it.
+    """
+    options = {}
+    if seed is not None:
+        options["seed"] = int(seed)
+    if temperature is not None:
+        options["temperature"] = float(temperature)
+    return options if options else None
+
+
+def _clean_response(content: str) -> str:
+    """
+    Strips whitespace and drops any non-ASCII characters.
+    """
+    content = content.strip()
+    # LLM output is almost always pure ASCII already, isascii() is a single C scan with no copies
+    if content.isascii():
+        return content
+    return content.encode('ascii','ignore').decode('ascii')
+
+
+def call_llm(system_prompt: str, user_prompt: str, *, seed: int | None = None, temperature: float | None = None) -> str:
+    from ollama import chat
+    from ollama import ChatResponse
+    response: ChatResponse = chat(
+        model=LLM_MODEL,
+        messages=_llm_messages(system_prompt, user_prompt),
+        options=_llm_options(seed, temperature),
+        keep_alive=LLM_KEEP_ALIVE,
+    )
+    return _clean_response(response['message']['content'])
+
+
+def _read_user_prompt(input_fpath: Path) -> str:
+    input_prompt = input_fpath.read_text()
+    if input_prompt.strip() == "":
+        raise ValueError("Input prompt file is empty.")
+    return USER_TEMPLATE.format(input_prompt=input_prompt)
+
+
+def _check_plain_single_document(yaml, text: str, loader) -> None:
+    """
+    Syntax check through the composer, which builds the node graph but no Python objects.
+    Rejects what safe_load would for a spec: aliases to undefined anchors, more than one document
+    and explicit tags the safe loader can't build (eg: !!python/object).
+    Raises yaml.YAMLError.
+    """
+    root = yaml.compose(text, Loader=loader)
+    # merge (<<) and value (=) keys are resolved by flatten_mapping, not by a registered constructor
+    safe_tags = set(loader.yaml_constructors) | {"tag:yaml.org,2002:merge", "tag:yaml.org,2002:value"}
+    seen = set()
+    stack = [root] if root is not None else []
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:  # aliased nodes are shared, and may be recursive
+            continue
+        seen.add(id(node))
+        if node.tag not in safe_tags:
+            raise yaml.YAMLError(f"YAML tag {node.tag!r} is not allowed in a video spec")
+        if isinstance(node, yaml.MappingNode):
+            for key, value in node.value:
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(node, yaml.SequenceNode):
+            stack.extend(node.value)
+
+
+def _write_script_yaml(output_yaml: str, output_yaml_path: Path) -> None:
+    """
+    Validates the LLM output and writes it to output_yaml_path.
+    Invalid YAML is written to a sibling .err file for manual fixing (output_yaml_path is left untouched),
+    then ValueError is raised.
+    """
+    import yaml
+    yaml_loader, yaml_dumper = _yaml_loader_dumper()
+
+    # Check if yaml is valid. Output that is written as-is only needs a syntax check, so it is only
+    # composed into nodes without building any Python objects
+    write_raw = _RE_GLOBAL_START.match(output_yaml) is not None
     try:
-        parsed_yaml = yaml.safe_load(output_yaml)
-        with open(output_yaml_path, 'w') as f:
-            yaml.dump(parsed_yaml, f, sort_keys=False, width=10000)
+        if write_raw:
+            _check_plain_single_document(yaml, output_yaml, yaml_loader)
+        else:
+            parsed_yaml = yaml.load(output_yaml, Loader=yaml_loader)
     except yaml.YAMLError as e:
-        # write error to a file for debugging
-        # error_log_path = output_yaml_path.parent / "yaml_error.log"
-        with open(output_yaml_path, 'w') as f:
-            f.write("Generated YAML:\n")
-            f.write(output_yaml)
-        print(f"YAML output written to: {output_yaml_path}")
+        err_path = output_yaml_path.with_suffix(".err")
+        err_path.write_text(output_yaml, encoding="utf-8")
+        print(f"YAML output written to: {err_path}")
         raise ValueError(f"Generated YAML is invalid, fix it manually: {e}")
-    
+
+    with output_yaml_path.open("w", encoding="utf-8", buffering=1 << 20) as f:
+        if write_raw:
+            f.write(output_yaml + "\n")
+        else:
+            # anything before global: (doc markers, comments, ...) gets normalised away by a re-dump
+            yaml.dump(parsed_yaml, f, Dumper=yaml_dumper, sort_keys=False, width=10000)
+
     print(f"Generated video.yaml: {output_yaml_path}")
+
+
+def generate_script(input_fpath:Path, output_yaml_path:Path, *, seed: int | None = None, temperature: float | None = None):
+    user_prompt = _read_user_prompt(input_fpath)
+    output_yaml = call_llm(SYSTEM_PROMPT, user_prompt, seed=seed, temperature=temperature)
+    _write_script_yaml(output_yaml, Path(output_yaml_path))
+
+
+def generate_scripts(
+    input_fpaths: List[Path],
+    output_yaml_paths: List[Path],
+    *,
+    seed: int | None = None,
+    temperature: float | None = None,
+    concurrency: int = 4,
+) -> None:
+    """
+    Batch version of generate_script, eg: for generating many videos in one go.
+
+    Up to `concurrency` requests are in flight at once on a single ollama AsyncClient,
+    so the model stays resident and the server can overlap them (set OLLAMA_NUM_PARALLEL to match).
+    Every script is attempted, failures are collected and raised together at the end.
+    """
+    import asyncio
+    from ollama import AsyncClient
+
+    if len(input_fpaths) != len(output_yaml_paths):
+        raise ValueError("input_fpaths and output_yaml_paths must have the same length.")
+
+    user_prompts = [_read_user_prompt(Path(p)) for p in input_fpaths]
+    options = _llm_options(seed, temperature)
+
+    async def run_all() -> list:
+        client = AsyncClient()
+        sem = asyncio.Semaphore(max(1, concurrency))
+
+        async def one(user_prompt: str) -> str:
+            async with sem:
+                response = await client.chat(
+                    model=LLM_MODEL,
+                    messages=_llm_messages(SYSTEM_PROMPT, user_prompt),
+                    options=options,
+                    keep_alive=LLM_KEEP_ALIVE,
+                )
+            return _clean_response(response['message']['content'])
+
+        try:
+            return await asyncio.gather(*(one(u) for u in user_prompts), return_exceptions=True)
+        finally:
+            # close the underlying httpx connection pool (AsyncClient only got close() in later releases)
+            await client._client.aclose()
+
+    results = asyncio.run(run_all())
+
+    errors = []
+    for output_yaml, output_yaml_path in zip(results, output_yaml_paths):
+        if isinstance(output_yaml, BaseException):
+            errors.append(f"{output_yaml_path}: {output_yaml}")
+            continue
+        try:
+            _write_script_yaml(output_yaml, Path(output_yaml_path))
+        except ValueError as e:
+            errors.append(f"{output_yaml_path}: {e}")
+
+    if errors:
+        raise RuntimeError("Some scripts failed to generate:\n" + "\n".join(errors))
+
+
 if __name__ == "__main__":
     print("Testing script generation...")
     input_fpath = Path("script_prompt.txt")
@@ -1,8 +1,11 @@
 # subtitles_gen.py
 from __future__ import annotations
 
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+
 
 
 # -----------------------------
@@ -13,13 +16,13 @@ def sec_to_ass_time(t: float) -> str:
     ASS time format: H:MM:SS.cs  (centiseconds)
     Example: 0:00:01.23
     """
-    if t < 0:
-        t = 0
-    h = int(t // 3600)
-    m = int((t % 3600) // 60)
-    s = int(t % 60)
-    cs = int(round((t - int(t)) * 100))
-    return f"{h}:{m:02d}:{s:02d}.{cs:02d}"
+    # Round once to whole centiseconds, then split with integer divmod.
+    # (Rounding only the fraction could yield ".100" for times like 1.996)
+    cs_total = 0 if t < 0 else int(t * 100 + 0.5)
+    s_total, cs = divmod(cs_total, 100)
+    m_total, s = divmod(s_total, 60)
+    h, m = divmod(m_total, 60)
+    return "%d:%02d:%02d.%02d" % (h, m, s, cs)
 
 
 def clean_word(w: str) -> str:
@@ -52,10 +55,14 @@ def load_words_from_mfa_json(json_path: str | Path) -> List[Dict[str, Any]]:
       ...
     ]
     """
-    import json
+    # imported here so the ASS-only helpers (and batch worker start up) don't pay for it
+    try:
+        from orjson import loads as json_loads  # optional, parses bytes in C, much faster on MFA's numeric arrays
+    except ImportError:
+        from json import loads as json_loads
 
     json_path = Path(json_path)
-    data = json.loads(json_path.read_text(encoding="utf-8"))
+    data = json_loads(json_path.read_bytes())
 
     try:
         entries = data["tiers"]["words"]["entries"]
@@ -69,7 +76,9 @@ def load_words_from_mfa_json(json_path: str | Path) -> List[Dict[str, Any]]:
     if not isinstance(entries, list):
         raise ValueError(f"MFA JSON words.entries is not a list in {json_path}")
 
-    words: List[Dict[str, Any]] = []
+    # sized once up front, filled by index and trimmed to the entries that were usable
+    words: List[Dict[str, Any]] = [None] * len(entries)  # type: ignore[list-item]
+    j = 0
     for item in entries:
         # Each item should be [start, end, label]
         if not isinstance(item, list) or len(item) != 3:
@@ -82,9 +91,9 @@ def load_words_from_mfa_json(json_path: str | Path) -> List[Dict[str, Any]]:
         # if not label or label.lower() in {"sp", "sil", "spn", "<unk>"}:
         #     continue
 
-        words.append(
-            {"word": label, "start": float(start), "end": float(end)}
-        )
+        words[j] = {"word": label, "start": float(start), "end": float(end)}
+        j += 1
+    del words[j:]
 
     if not words:
         raise RuntimeError(
@@ -98,6 +107,45 @@ def load_words_from_mfa_json(json_path: str | Path) -> List[Dict[str, Any]]:
 # -----------------------------
 # Word grouping into readable lines
 # -----------------------------
+# Transcripts at least this long use the numba compiled split, below it numba's import/JIT cost outweighs the loop
+_NUMBA_MIN_WORDS = 5000
+_numba_split = None  # compiled _split_indices, False if numba is unavailable
+
+
+def _split_indices(starts, ends, max_words, max_dur, max_gap, out):
+    """
+    Fills out (len n + 1) with the line break indices [0, ..., n] for chunk_words_into_lines
+    and returns how many were written. Written in the numba friendly subset, with no module
+    globals, so numpy can stay a lazy import.
+    """
+    n = starts.shape[0]
+    out[0] = 0
+    k = 1
+    line_start = 0
+    for i in range(1, n):
+        if (
+            i - line_start >= max_words
+            or ends[i] - starts[line_start] > max_dur
+            or starts[i] - ends[i - 1] > max_gap
+        ):
+            out[k] = i
+            k += 1
+            line_start = i
+    out[k] = n
+    return k + 1
+
+
+def _get_numba_split():
+    global _numba_split
+    if _numba_split is None:
+        try:
+            import numba
+            _numba_split = numba.njit(cache=True)(_split_indices)
+        except ImportError:
+            _numba_split = False
+    return _numba_split or None
+
+
 def chunk_words_into_lines(
     words: List[Dict[str, Any]],
     *,
@@ -112,28 +160,42 @@ def chunk_words_into_lines(
     if not words:
         return []
 
-    lines: List[List[Dict[str, Any]]] = []
-    current: List[Dict[str, Any]] = [words[0]]
-
-    for w in words[1:]:
-        prev = current[-1]
-        gap = w["start"] - prev["end"]
-        duration_if_added = w["end"] - current[0]["start"]
-
-        too_many_words = len(current) >= max_words_per_line
-        too_long = duration_if_added > max_line_duration
-        too_big_gap = gap > max_gap
-
-        if too_many_words or too_long or too_big_gap:
-            lines.append(current)
-            current = [w]
-        else:
-            current.append(w)
-
-    if current:
-        lines.append(current)
-
-    return lines
+    n = len(words)
+
+    if n >= _NUMBA_MIN_WORDS:
+        split = _get_numba_split()
+        if split is not None:
+            import numpy as np
+            starts = np.fromiter((w["start"] for w in words), dtype=np.float64, count=n)
+            ends = np.fromiter((w["end"] for w in words), dtype=np.float64, count=n)
+            out = np.empty(n + 1, np.int64)
+            k = split(starts, ends, max_words_per_line, float(max_line_duration), float(max_gap), out)
+            breaks = out[:k].tolist()
+            return [words[a:b] for a, b in zip(breaks, breaks[1:])]
+
+    # Plain scan: word count / duration limits depend on where the current line started,
+    # so this doesn't vectorize, and for normal transcripts it is only a few hundred words.
+    # At most one break per word, so n + 1 slots always suffice
+    breaks = [0] * (n + 1)
+    k = 1
+    line_start_t = words[0]["start"]
+    line_start = 0
+    prev_end = words[0]["end"]
+    for i in range(1, n):
+        w = words[i]
+        if (
+            i - line_start >= max_words_per_line
+            or w["end"] - line_start_t > max_line_duration
+            or w["start"] - prev_end > max_gap
+        ):
+            breaks[k] = i
+            k += 1
+            line_start = i
+            line_start_t = w["start"]
+        prev_end = w["end"]
+    breaks[k] = n
+
+    return [words[breaks[i]:breaks[i + 1]] for i in range(k)]
 
 
 # -----------------------------
@@ -144,16 +206,33 @@ def make_karaoke_ass_text(words_line: List[Dict[str, Any]]) -> str:
     Builds ASS karaoke timing tags using \\k (centiseconds).
     Example: {\\k12}Hello {\\k25}world
     """
-    parts = []
-    for w in words_line:
-        dur_cs = max(1, int(round((w["end"] - w["start"]) * 100)))
-        parts.append(f"{{\\k{dur_cs}}}{w['word']}")
-    return " ".join(parts)
+    return " ".join(
+        "{\\k%d}%s" % (max(1, round((w["end"] - w["start"]) * 100)), w["word"])
+        for w in words_line
+    )
 
 
 # -----------------------------
 # ASS generator
 # -----------------------------
+_ASS_HEADER_TEMPLATE = """[Script Info]
+ScriptType: v4.00+
+PlayResX: {video_w}
+PlayResY: {video_h}
+WrapStyle: 0
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,{font},{font_size},{primary_color},{secondary_color},{outline_color},&H00000000,0,0,0,0,100,100,0,0,1,{outline},{shadow},{align},120,120,{bottom_margin},1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+# start, end, karaoke text
+_ASS_DIALOGUE = "Dialogue: 0,%s,%s,Default,,0,0,0,,%s\n"
+
 def generate_ass_karaoke(
     words: List[Dict[str, Any]],
     out_ass_path: str | Path,
@@ -181,32 +260,37 @@ def generate_ass_karaoke(
         max_line_duration=max_line_duration,
     )
 
-    header = f"""[Script Info]
-ScriptType: v4.00+
-PlayResX: {video_w}
-PlayResY: {video_h}
-WrapStyle: 0
-ScaledBorderAndShadow: yes
-
-[V4+ Styles]
-Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
-Style: Default,{font},{font_size},{primary_color},{secondary_color},{outline_color},&H00000000,0,0,0,0,100,100,0,0,1,{outline},{shadow},{align},120,120,{bottom_margin},1
-
-[Events]
-Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
-"""
-
-    events = []
-    for words_line in lines:
-        start = words_line[0]["start"]
-        end = words_line[-1]["end"] + 0.05  # small padding
-        text = make_karaoke_ass_text(words_line)
+    header = _ASS_HEADER_TEMPLATE.format(
+        video_w=video_w,
+        video_h=video_h,
+        font=font,
+        font_size=font_size,
+        primary_color=primary_color,
+        secondary_color=secondary_color,
+        outline_color=outline_color,
+        outline=outline,
+        shadow=shadow,
+        align=align,
+        bottom_margin=bottom_margin,
+    )
 
-        events.append(
-            f"Dialogue: 0,{sec_to_ass_time(start)},{sec_to_ass_time(end)},Default,,0,0,0,,{text}"
+    body = "".join(
+        _ASS_DIALOGUE % (
+            sec_to_ass_time(words_line[0]["start"]),
+            sec_to_ass_time(words_line[-1]["end"] + 0.05),  # small padding on the end
+            make_karaoke_ass_text(words_line),
         )
+        for words_line in lines
+    ) or "\n"
 
-    out_ass_path.write_text(header + "\n".join(events) + "\n", encoding="utf-8")
+    # Encoded once and handed to the OS in (normally) a single write, no text layer / per line encoder
+    data = memoryview((header + body).encode("utf-8"))
+    fd = os.open(out_ass_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
     return out_ass_path
 
 
@@ -228,6 +312,32 @@ def generate_subtitles_from_mfa_json(
     )
 
 
+def _subtitles_from_pair(pair: Tuple[str | Path, str | Path]) -> Path:
+    # module level so ProcessPoolExecutor can pickle it
+    mfa_json_path, out_ass_path = pair
+    return generate_subtitles_from_mfa_json(mfa_json_path, out_ass_path)
+
+
+def generate_subtitles_batch(
+    pairs: List[Tuple[str | Path, str | Path]],
+    *,
+    workers: Optional[int] = None,
+) -> List[Path]:
+    """
+    Converts many (mfa_json_path, out_ass_path) pairs at once, eg: when building several videos.
+    Each conversion is independent and CPU bound, so they are spread over worker processes.
+    workers defaults to os.cpu_count(). Returns the written .ass paths in input order.
+    """
+    if not pairs:
+        return []
+    workers = min(workers or os.cpu_count() or 1, len(pairs))
+    if workers == 1:
+        return [_subtitles_from_pair(p) for p in pairs]
+
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(_subtitles_from_pair, pairs, chunksize=4))
+
+
 # -----------------------------
 # Test runner
 # -----------------------------
@@ -0,0 +1,107 @@
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import compositor  # noqa: E402
+
+
+def _graph(n: int, crossfade_dur: float = 0.5, with_bgm: bool = False, subs: Path = Path("subs.ass")):
+    return compositor._final_filtergraph(
+        [2.5] * n,
+        (["slow_zoom", "pan_left", "pan_right", "static"] * n)[:n],
+        width=360,
+        height=640,
+        fps=30,
+        crossfade_dur=crossfade_dur,
+        subtitles_ass=subs,
+        with_bgm=with_bgm,
+    )
+
+
+class FinalFiltergraphTest(unittest.TestCase):
+    def test_scene_branches_keep_a_frame_rate_before_xfade(self):
+        filter_complex, _ = _graph(3)
+        self.assertIn("xfade", filter_complex)
+        for i in range(3):
+            branch = next(p for p in filter_complex.split(";") if p.endswith(f"[s{i}]"))
+            # xfade needs CFR input: any setpts must be followed by an fps filter again
+            last_setpts = branch.rfind("setpts")
+            if last_setpts != -1:
+                self.assertIn("fps=", branch[last_setpts:])
+            self.assertIn("fps=30", branch)
+
+    def test_xfade_offsets_follow_the_timeline(self):
+        filter_complex, _ = _graph(3)
+        offsets = [float(x) for x in re.findall(r"offset=([0-9.]+)", filter_complex)]
+        self.assertEqual(offsets, [2.0, 4.0])
+
+    def test_hard_cuts_use_concat(self):
+        filter_complex, _ = _graph(3, crossfade_dur=0)
+        self.assertIn("concat=n=3:v=1:a=0", filter_complex)
+        self.assertNotIn("xfade", filter_complex)
+
+    def test_audio_map(self):
+        self.assertEqual(_graph(3)[1], "3:a")
+        filter_complex, audio_map = _graph(3, with_bgm=True)
+        self.assertEqual(audio_map, "[aout]")
+        self.assertIn("[3:a]volume=1[fg]", filter_complex)
+        self.assertIn("[4:a]volume=0.2[bg]", filter_complex)
+
+
+@unittest.skipUnless(shutil.which("ffmpeg"), "ffmpeg not installed")
+class RenderFinalTest(unittest.TestCase):
+    def test_three_scene_xfade_render(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            imgs = []
+            for i, color in enumerate(("red", "green", "blue")):
+                img = tmp / f"img{i}.png"
+                subprocess.run(
+                    ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"color=c={color}:s=360x640",
+                     "-frames:v", "1", str(img)],
+                    check=True,
+                )
+                imgs.append(img)
+            wav = tmp / "audio.wav"
+            subprocess.run(
+                ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=6",
+                 str(wav)],
+                check=True,
+            )
+            ass = tmp / "subs.ass"
+            ass.write_text(
+                "[Script Info]\nScriptType: v4.00+\nPlayResX: 360\nPlayResY: 640\n\n"
+                "[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+                "Dialogue: 0,0:00:00.00,0:00:01.00,Default,,0,0,0,,hello\n",
+                encoding="utf-8",
+            )
+            out = tmp / "final.mp4"
+
+            compositor._render_final(
+                imgs,
+                [2.5, 2.5, 2.0],
+                ["slow_zoom", "pan_left", "pan_right"],
+                out,
+                width=360,
+                height=640,
+                fps=30,
+                crossfade_dur=0.5,
+                audio_wav=wav,
+                subtitles_ass=ass,
+            )
+
+            duration = float(subprocess.run(
+                ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(out)],
+                check=True, capture_output=True, text=True,
+            ).stdout)
+            self.assertAlmostEqual(duration, 6.0, delta=0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()